@@ -8,17 +8,80 @@
 # 	4a) For each subproject, copy everything except "include" into $DEST/libs
 # 	4b) For each subproject, copy the contents of the "includes" folder into $DEST/boost
 #
-# 	Usage: %0 source dest
+# 	Usage: %0 [--jobs N] [--link copy|hardlink|reflink] [--dry-run]
+# 	          [--incremental] [--archive FILE] [--crlf-archive FILE]
+# 	          [--header-index FILE] source dest
+#
+# 	Or, in-process:
+#
+# 		import MakeBoostDistro
+# 		result = MakeBoostDistro.main(source, dest, jobs=N, progress=callback)
+#
+# 	which returns a DistroResult with the files, bytes, header conflicts
+# 	and timings of the run.
+#
+# 	The steps above only plan the distro: they fill in a Manifest with
+# 	every folder and file to create, the library each file comes from, and
+# 	the headers that one library overwrites in another's boost/ folder.
+# 	The manifest is then executed as one bulk job. Libraries are planned in
+# 	sorted order, so the resulting boost/ folder and the "## Overwriting"
+# 	reports are always the same.
+#
+# 	With --jobs N, the files are copied by a pool of N worker threads.
+#
+# 	With --dry-run, the plan is summarised and nothing is written.
+#
+# 	With --archive FILE (.tar.gz, .tar.bz2, .tar, .zip or, with zstd or
+# 	zstandard installed, .tar.zst and, with py7zr, .7z; may be
+# 	repeated), the manifest is streamed straight
+# 	into the archives and the distro tree is never written; dest only
+# 	names the top folder in them. --crlf-archive FILE does the same with
+# 	CRLF line endings in text files, as for the Windows archives. With
+# 	SOURCE_DATE_EPOCH set, the tar and zip files are reproducible.
+#
+# 	With --incremental, an existing dest is updated in place rather than
+# 	renamed and rebuilt: files with the same size and mtime (or, failing
+# 	that, the same content) are kept, and files that are no longer part
+# 	of the distro are removed.
+#
+# 	With --link hardlink or --link reflink, files are hard linked or cloned
+# 	(copy-on-write, Linux FICLONE) from the source instead of copied. When
+# 	that is not possible, e.g. across filesystems, the file is copied. A
+# 	hard linked tree shares its files with the source checkout, so it must
+# 	only be read afterwards, never modified in place.
+#
+# 	With --header-index FILE, the library, source and git blob id of every
+# 	header of the merged boost/ folder are kept in a JSON file, and the
+# 	libraries whose headers changed since the last run are listed. Together
+# 	with --incremental, the headers of the unchanged libraries are taken to
+# 	be up to date without being compared with the distro, when the last run
+# 	wrote that same distro folder, and not archives.
 
 from __future__ import print_function
 
-import os, sys
+import os
 import shutil
 import stat
 import six
 import datetime
-
-IgnoreFiles = shutil.ignore_patterns(
+import errno
+import time
+import filecmp
+import functools
+import hashlib
+import json
+from collections import OrderedDict
+from optparse import OptionParser
+from multiprocessing.pool import ThreadPool
+
+import tree_walk
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows
+
+IgnoreFiles = tree_walk.IgnorePatterns(
     "[.]*",
     "[.]gitattributes",
     "[.]gitignore",
@@ -30,195 +93,784 @@ IgnoreFiles = shutil.ignore_patterns(
 
 
 def IgnoreFile(src, name):
-    return len(IgnoreFiles(src, [name])) > 0
+    return IgnoreFiles.ignored(name)
 
 
-## from <http://stackoverflow.com/questions/1868714/how-do-i-copy-an-entire-directory-of-files-into-an-existing-directory-using-pyth>
-def MergeTree(src, dst, symlinks=False):
-    if not os.path.exists(dst):
-        os.makedirs(dst)
-        shutil.copystat(src, dst)
-    lst = os.listdir(src)
-    excl = IgnoreFiles(src, lst)
-    lst = [x for x in lst if x not in excl]
-    for item in lst:
-        s = os.path.join(src, item)
-        d = os.path.join(dst, item)
-        if symlinks and os.path.islink(s):
-            if os.path.lexists(d):
-                os.remove(d)
-            os.symlink(os.readlink(s), d)
+# 	"copy", "hardlink" or "reflink"; set from the --link option.
+CopyMode = "copy"
+CopyFallback = []
+
+## from linux/fs.h
+FICLONE = 0x40049409
+
+
+def Reflink(s, d):
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "reflinks are not supported", s)
+    with open(s, "rb") as fs:
+        with open(d, "wb") as fd:
             try:
-                st = os.lstat(s)
-                mode = stat.S_IMODE(st.st_mode)
-                os.lchmod(d, mode)
-            except:
-                pass  # lchmod not available
-        elif os.path.isdir(s):
-            MergeTree(s, d, symlinks)
-        else:
-            if os.path.exists(d):
+                fcntl.ioctl(fd.fileno(), FICLONE, fs.fileno())
+            except IOError as e:
+                raise OSError(e.errno, e.strerror, s)
+    shutil.copystat(s, d)
+
+
+def LinkOrCopy(s, d):
+    # 	Drop-in replacement for shutil.copy2 that honours CopyMode
+    if CopyMode != "copy":
+        # 	Never write through an existing link into somebody else's source
+        if os.path.lexists(d):
+            os.remove(d)
+        try:
+            if CopyMode == "hardlink":
+                os.link(s, d)
+            else:
+                Reflink(s, d)
+            return d
+        except OSError as e:
+            if not CopyFallback:
+                CopyFallback.append(e)
+                print("## Cannot %s %s (%s), copying instead" % (CopyMode, s, e))
+    shutil.copy2(s, d)
+    return d
+
+
+class Manifest(object):
+    """
+    The plan for a distro: the folders to create, in creation order, and
+    for each destination file its source, size and owning library. A file
+    planned twice keeps its last source; the earlier owner is recorded as
+    an overwrite conflict.
+    """
+
+    def __init__(self):
+        self.dirs = OrderedDict()  # dst -> src (None: no stat to copy)
+        self.files = OrderedDict()  # dst -> (src, owner, size)
+        self.symlinks = OrderedDict()  # dst -> (src, owner)
+        self.conflicts = []  # (dst, src, old owner, new owner)
+        self.owners = []
+
+    def add_owner(self, owner):
+        if owner not in self.owners:
+            self.owners.append(owner)
+
+    def add_dir(self, s, d):
+        if d not in self.dirs:
+            self.dirs[d] = s
+
+    def add_file(self, s, d, owner, report=False, size=None):
+        self.add_owner(owner)
+        if d in self.files or d in self.symlinks:
+            if report:
                 print("## Overwriting file %s with %s" % (d, s))
-            shutil.copy2(s, d)
+            old = self.files.pop(d, None) or self.symlinks.pop(d)
+            self.conflicts.append((d, s, old[1], owner))
+        if size is None:
+            size = os.stat(s).st_size
+        self.files[d] = (s, owner, size)
+
+    def add_symlink(self, s, d, owner):
+        self.add_owner(owner)
+        self.files.pop(d, None)
+        self.symlinks[d] = (s, owner)
+
+    def size(self):
+        return sum(f[2] for f in self.files.values())
+
+    def summary(self):
+        # 	owner -> [files, bytes, seconds]
+        totals = OrderedDict((o, [0, 0, 0.0]) for o in self.owners)
+        for s, owner, size in self.files.values():
+            totals[owner][0] += 1
+            totals[owner][1] += size
+        return totals
+
+
+## from <http://stackoverflow.com/questions/1868714/how-do-i-copy-an-entire-directory-of-files-into-an-existing-directory-using-pyth>
+def MergeTree(m, owner, src, dst, symlinks=False):
+    m.add_dir(src, dst)
+    dests = {src: dst}
+    for dirpath, dirs, files in tree_walk.walk(src, IgnoreFiles, symlinks):
+        d = dests.pop(dirpath)
+        for e in dirs:
+            dests[e.path] = os.path.join(d, e.name)
+            m.add_dir(e.path, dests[e.path])
+        for e in files:
+            if symlinks and e.is_symlink():
+                m.add_symlink(e.path, os.path.join(d, e.name), owner)
+            else:
+                CopyEntryInto(m, owner, e, d, report=True)
+
+
+def CopyEntryInto(m, owner, e, d, report=False):
+    m.add_file(e.path, os.path.join(d, e.name), owner, report, e.stat().st_size)
 
 
-def CopyFile(s, d, f):
-    if os.path.isfile(os.path.join(s, f)) and not IgnoreFile(s, f):
-        shutil.copy2(os.path.join(s, f), os.path.join(d, f))
+def CopyFiles(m, owner, s, d, exclude=()):
+    # 	All the files directly in s, but not its folders
+    for e in tree_walk.scan(s, IgnoreFiles):
+        if e.is_file() and e.name not in exclude:
+            CopyEntryInto(m, owner, e, d)
 
 
-def CopyDir(s, d, dd):
+def CopyDir(m, owner, s, d, dd):
     if os.path.isdir(os.path.join(s, dd)) and not IgnoreFile(s, dd):
-        shutil.copytree(
-            os.path.join(s, dd), os.path.join(d, dd), symlinks=False, ignore=IgnoreFiles
-        )
+        MergeTree(m, owner, os.path.join(s, dd), os.path.join(d, dd), symlinks=False)
 
 
-def MergeIf(s, d, dd):
+def MergeIf(m, owner, s, d, dd):
     # 	if dd == 'detail':
     # 		print "MergeIf %s -> %s" % (os.path.join(s, dd), os.path.join(d, dd))
     if os.path.exists(os.path.join(s, dd)):
-        MergeTree(os.path.join(s, dd), os.path.join(d, dd), symlinks=False)
+        MergeTree(m, owner, os.path.join(s, dd), os.path.join(d, dd), symlinks=False)
 
 
-def CopyInclude(src, dst):
-    for item in os.listdir(src):
-        if IgnoreFile(src, item):
-            continue
-        if item == "pending":
+def CopyInclude(m, owner, src, dst):
+    for e in tree_walk.scan(src, IgnoreFiles):
+        if e.name == "pending":
             continue
-        if item == "detail":
+        if e.name == "detail":
             continue
-        s = os.path.join(src, item)
-        d = os.path.join(dst, item)
-        if os.path.isdir(s):
-            MergeTree(s, d, symlinks=False)
-        else:
-            if os.path.exists(d):
-                print("## Overwriting file %s with %s" % (d, s))
-            CopyFile(src, dst, item)
+        if e.is_dir():
+            MergeTree(m, owner, e.path, os.path.join(dst, e.name), symlinks=False)
+        elif e.is_file():
+            CopyEntryInto(m, owner, e, dst, report=True)
+
+
+def CopyProjectTree(m, owner, Source, Dest):
+    # 	Everything except the "include" directory
+    m.add_dir(None, Dest)
+    for e in tree_walk.scan(Source, IgnoreFiles):
+        if e.is_file():
+            CopyEntryInto(m, owner, e, Dest)
+        elif e.is_dir() and e.name != "include":
+            MergeTree(m, owner, e.path, os.path.join(Dest, e.name), symlinks=False)
+    # shutil.copytree(Source, Dest, symlinks=False, ignore=shutil.ignore_patterns('\.*', "include"))
 
 
-def CopySubProject(src, dst, headers, p):
+def CopySubProject(m, src, dst, headers, p):
     # 	First, everything except the "include" directory
-    Source = os.path.join(src, p)
-    Dest = os.path.join(dst, p)
     # 	print "CopySubProject %p" % p
-    os.makedirs(Dest)
-    for item in os.listdir(Source):
-        if os.path.isfile(os.path.join(Source, item)):
-            CopyFile(Source, Dest, item)
-        elif item != "include":
-            CopyDir(Source, Dest, item)
-
-    # shutil.copytree(Source, Dest, symlinks=False, ignore=shutil.ignore_patterns('\.*', "include"))
+    CopyProjectTree(m, p, os.path.join(src, p), os.path.join(dst, p))
 
     # Now the includes
     Source = os.path.join(src, "%s/include/boost" % p)
     if os.path.exists(Source):
-        CopyInclude(Source, headers)
+        CopyInclude(m, p, Source, headers)
         # 		MergeTree(Source, Dest, symlinks=False, ignore=shutil.ignore_patterns('\.*', 'detail', 'pending'))
-        MergeIf(Source, headers, "detail")
-        MergeIf(Source, headers, "pending")
+        MergeIf(m, p, Source, headers, "detail")
+        MergeIf(m, p, Source, headers, "pending")
 
 
-def CopyNestedProject(src, dst, headers, p):
+def CopyNestedProject(m, src, dst, headers, p):
     # 	First, everything except the "include" directory
-    Source = os.path.join(src, p[1])
-    Dest = os.path.join(dst, p[1])
-    os.makedirs(Dest)
-    for item in os.listdir(Source):
-        if os.path.isfile(os.path.join(Source, item)):
-            CopyFile(Source, Dest, item)
-        elif item != "include":
-            CopyDir(Source, Dest, item)
-    # 	shutil.copytree(Source, Dest, symlinks=False, ignore=shutil.ignore_patterns('\.*', "include"))
+    owner = "/".join(p)
+    CopyProjectTree(m, owner, os.path.join(src, p[1]), os.path.join(dst, p[1]))
 
     Source = os.path.join(src, "%s/include/boost" % (p[1]))
     #  	Dest = os.path.join(headers, p)
     # 	print "Installing headers from %s to %s" % (Source, headers)
-    CopyInclude(Source, headers)
+    CopyInclude(m, owner, Source, headers)
     # # 	MergeTree(Source, Dest, symlinks=False, ignore=shutil.ignore_patterns('\.*', 'detail', 'pending'))
     # 	MergeIf(Source, headers, 'detail')
     # 	MergeIf(Source, headers, 'pending')
 
 
+def SubProjectKey(p):
+    # 	Sort key, so that "numeric" and ("numeric", "conversion") can be compared
+    if isinstance(p, six.string_types):
+        return (p,)
+    return p
+
+
 BoostHeaders = "boost"
 BoostLibs = "libs"
 
 BoostSpecialFolders = ["doc", "more", "status", "tools"]
 
-SourceRoot = sys.argv[1]
-DestRoot = sys.argv[2]
-
-print("Source = %s" % SourceRoot)
-print("Dest   = %s" % DestRoot)
 
-if not os.path.exists(SourceRoot):
-    print("## Error: %s does not exist" % SourceRoot)
-    exit(1)
+def FindSubProjects(SourceLibs):
+    BoostSubProjects = set()
+    for f in os.listdir(SourceLibs):
+        if os.path.isdir(os.path.join(SourceLibs, f)):
+            if os.path.isfile(os.path.join(SourceLibs, f, "meta", "libraries.json")):
+                BoostSubProjects.add(f)
+            elif os.path.isdir(os.path.join(SourceLibs, f, "include")):
+                BoostSubProjects.add(f)
+            elif f == "headers":
+                BoostSubProjects.add(f)
+            elif os.path.isfile(os.path.join(SourceLibs, f, "sublibs")):
+                for s in os.listdir(os.path.join(SourceLibs, f)):
+                    if os.path.isdir(os.path.join(SourceLibs, f, s)):
+                        if os.path.isfile(
+                            os.path.join(SourceLibs, f, s, "meta", "libraries.json")
+                        ):
+                            BoostSubProjects.add((f, s))
+                        elif os.path.isdir(os.path.join(SourceLibs, f, s, "include")):
+                            BoostSubProjects.add((f, s))
+    return sorted(BoostSubProjects, key=SubProjectKey)
+
+
+def Plan(SourceRoot, DestRoot):
+    m = Manifest()
+    DestHeaders = os.path.join(DestRoot, BoostHeaders)
+    DestLibs = os.path.join(DestRoot, BoostLibs)
+    m.add_dir(None, DestRoot)
+    m.add_dir(None, DestHeaders)
+    m.add_dir(None, DestLibs)
+
+    ## Step 1
+    CopyFiles(m, ".", SourceRoot, DestRoot, exclude=["CMakeLists.txt"])
+
+    ## Step 2
+    for d in BoostSpecialFolders:
+        CopyDir(m, d, SourceRoot, DestRoot, d)
+
+    ## Step 3
+    SourceLibs = os.path.join(SourceRoot, BoostLibs)
+    CopyFiles(m, BoostLibs, SourceLibs, DestLibs)
+
+    ## Step 4
+    for p in FindSubProjects(SourceLibs):
+        if isinstance(p, six.string_types):
+            CopySubProject(m, SourceLibs, DestLibs, DestHeaders, p)
+        else:
+            NestedSource = os.path.join(SourceLibs, p[0])
+            NestedDest = os.path.join(DestLibs, p[0])
+            if NestedDest not in m.dirs:
+                m.add_dir(None, NestedDest)
+                CopyFiles(m, p[0], NestedSource, NestedDest)
+            CopyNestedProject(m, NestedSource, NestedDest, DestHeaders, p)
+    return m
+
+
+def GitBlobId(path):
+    # 	The id git gives the file's content, as in "git hash-object"
+    with open(path, "rb") as f:
+        data = f.read()
+    h = hashlib.sha1(b"blob %d\0" % len(data))
+    h.update(data)
+    return h.hexdigest()
+
+
+class HeaderIndex(object):
+    """
+    Which library owns each header of the merged boost/ folder, stored as
+    JSON next to the distro:
+
+        {"headers": {"boost/foo.hpp": {"library": ..., "source": ...,
+                                       "size": ..., "mtime": ..., "blob": ...}},
+         "conflicts": [["boost/foo.hpp", old owner, new owner], ...],
+         "distro": "/path/to/distro"}
+
+    Paths are relative to the distro and to the source checkout, and blob
+    is the git blob id of the source. When an index is rebuilt from a
+    previous one, the blob ids of sources with the same size and mtime
+    are reused rather than hashed again. distro is the real path of the
+    folder the headers were written to, or null when they were written to
+    archives or not at all.
+    """
+
+    def __init__(self, headers=None, conflicts=None, distro=None):
+        self.headers = headers or {}
+        self.conflicts = conflicts or []
+        self.distro = distro
+
+    @staticmethod
+    def load(filename):
+        if not os.path.isfile(filename):
+            return HeaderIndex()
+        with open(filename, "r") as f:
+            data = json.load(f)
+        return HeaderIndex(data["headers"], data["conflicts"], data.get("distro"))
+
+    def save(self, filename):
+        with open(filename, "w") as f:
+            json.dump(
+                {
+                    "headers": self.headers,
+                    "conflicts": self.conflicts,
+                    "distro": self.distro,
+                },
+                f,
+                indent=0,
+                sort_keys=True,
+            )
+
+    def owner(self, header):
+        # 	e.g. owner("boost/shared_ptr.hpp") -> "smart_ptr"
+        entry = self.headers.get(header)
+        return entry and entry["library"]
+
+    def libraries(self):
+        # 	library -> {header: (source, size, mtime)}
+        result = {}
+        for header, entry in self.headers.items():
+            result.setdefault(entry["library"], {})[header] = (
+                entry["source"],
+                entry["size"],
+                entry["mtime"],
+            )
+        return result
+
+    @staticmethod
+    def build(m, SourceRoot, DestRoot, previous):
+        index = HeaderIndex()
+        prefix = os.path.join(DestRoot, BoostHeaders) + os.sep
+        for d, (s, owner, size) in m.files.items():
+            if not d.startswith(prefix):
+                continue
+            header = "/".join(os.path.relpath(d, DestRoot).split(os.sep))
+            entry = {
+                "library": owner,
+                "source": "/".join(os.path.relpath(s, SourceRoot).split(os.sep)),
+                "size": size,
+                "mtime": os.stat(s).st_mtime_ns,
+            }
+            old = previous.headers.get(header)
+            if old and all(old[k] == entry[k] for k in ("source", "size", "mtime")):
+                entry["blob"] = old["blob"]
+            else:
+                entry["blob"] = GitBlobId(s)
+            index.headers[header] = entry
+        index.conflicts = [
+            ["/".join(os.path.relpath(d, DestRoot).split(os.sep)), old, new]
+            for d, s, old, new in m.conflicts
+        ]
+        return index
+
+    def trusted(self, previous, DestRoot):
+        # 	The destinations of the headers of the libraries whose headers
+        # 	are all as they were in previous, if previous describes the
+        # 	distro in DestRoot
+        if previous.distro != os.path.realpath(DestRoot):
+            return set()
+        changed = set(self.changes(previous)[0])
+        return set(
+            os.path.join(DestRoot, *header.split("/"))
+            for header, entry in self.headers.items()
+            if entry["library"] not in changed
+        )
 
-if os.path.exists(DestRoot):
+    def changes(self, previous):
+        # 	The libraries whose headers changed since previous, and the
+        # 	headers that now belong to another library
+        before = previous.libraries()
+        after = self.libraries()
+        changed = sorted(
+            library
+            for library in set(before) | set(after)
+            if before.get(library) != after.get(library)
+        )
+        moved = sorted(
+            (header, previous.owner(header), self.owner(header))
+            for header in self.headers
+            if header in previous.headers
+            and previous.owner(header) != self.owner(header)
+        )
+        return changed, moved
+
+
+def UpToDate(s, d):
+    # 	Is d, left over from a previous run, already a copy of s?
+    try:
+        dst = os.lstat(d)
+    except OSError:
+        return False
+    if not stat.S_ISREG(dst.st_mode):
+        return False
+    src = os.stat(s)
+    if os.path.samestat(src, dst):
+        # 	A hard link left by --link hardlink is not a copy
+        return CopyMode == "hardlink"
+    if CopyMode == "hardlink" or src.st_size != dst.st_size:
+        return False
+    if src.st_mtime == dst.st_mtime:
+        return True
+    # 	Same size, different time: only the content can tell
+    if filecmp.cmp(s, d, shallow=False):
+        shutil.copystat(s, d)
+        return True
+    return False
+
+
+def CopyEntry(entry, incremental=False, trusted=()):
+    d, (s, owner, size) = entry
+    t = time.time()
+    if incremental:
+        if d in trusted or UpToDate(s, d):
+            return owner, size, time.time() - t, False
+        # 	d may be a hard link into the source of an earlier distro
+        if os.path.lexists(d):
+            os.remove(d)
+    LinkOrCopy(s, d)
+    return owner, size, time.time() - t, True
+
+
+def Prune(m, DestRoot):
+    # 	Remove everything below DestRoot that is not in the manifest
+    removed = 0
+    for dirpath, dirnames, filenames in os.walk(DestRoot, topdown=True):
+        for name in list(dirnames):
+            d = os.path.join(dirpath, name)
+            if d not in m.dirs:
+                if os.path.islink(d):
+                    os.remove(d)
+                else:
+                    shutil.rmtree(d)
+                dirnames.remove(name)
+                removed += 1
+        for name in filenames:
+            d = os.path.join(dirpath, name)
+            if d not in m.files and d not in m.symlinks:
+                os.remove(d)
+                removed += 1
+    return removed
+
+
+def Execute(m, jobs=1, incremental=None, progress=None, trusted=()):
+    # 	Returns the per-owner [files, bytes, seconds] actually written.
+    # 	With incremental set to the distro root, the files already there
+    # 	are reused and whatever is no longer in the manifest is removed;
+    # 	the files in trusted are known to be up to date, if present.
+    # 	progress(files done, files total, bytes done, bytes total) is
+    # 	called, from this thread, after each file.
+    totals = OrderedDict((o, [0, 0, 0.0]) for o in m.owners)
+    if incremental:
+        removed = Prune(m, incremental)
+    for d in m.dirs:
+        if not os.path.isdir(d):
+            os.makedirs(d)
+    for d, (s, owner) in m.symlinks.items():
+        if os.path.lexists(d):
+            os.remove(d)
+        os.symlink(os.readlink(s), d)
+        try:
+            st = os.lstat(s)
+            mode = stat.S_IMODE(st.st_mode)
+            os.lchmod(d, mode)
+        except:
+            pass  # lchmod not available
+
+    if incremental:
+        trusted = set(d for d in trusted if d in m.files and os.path.isfile(d))
+    copy = functools.partial(CopyEntry, incremental=bool(incremental), trusted=trusted)
+    if jobs > 1:
+        pool = ThreadPool(jobs)
+        copied = pool.imap_unordered(copy, m.files.items(), chunksize=64)
+    else:
+        pool = None
+        copied = (copy(entry) for entry in m.files.items())
+    unchanged = 0
+    done = [0, 0, len(m.files), m.size()]
+    for owner, size, seconds, written in copied:
+        if written:
+            totals[owner][0] += 1
+            totals[owner][1] += size
+        else:
+            unchanged += 1
+        totals[owner][2] += seconds
+        if progress:
+            done[0] += 1
+            done[1] += size
+            progress(*done)
+    if pool:
+        pool.close()
+        pool.join()
+
+    # 	Like copytree, copy the folder stats once their content is written
+    for d, s in reversed(m.dirs.items()):
+        if s is not None:
+            shutil.copystat(s, d)
+    if incremental:
+        print("Incremental: %d files unchanged, %d removed" % (unchanged, removed))
+    return totals
+
+
+def AddOverlays(m, DestRoot, overlays):
+    # 	(source, path relative to DestRoot) pairs written over the distro,
+    # 	e.g. docs that are generated outside of the boost checkout
+    for s, rel in overlays:
+        d = os.path.join(DestRoot, rel)
+        if os.path.isdir(s):
+            MergeTree(m, "overlay", s, d)
+        else:
+            m.add_file(s, d, "overlay")
+
+
+def ArchiveName(DestRoot, path):
+    # 	Archives hold the distro in a folder named after DestRoot
+    top = os.path.basename(os.path.normpath(DestRoot))
+    rel = os.path.relpath(path, DestRoot)
+    if rel == ".":
+        return top
+    return "/".join([top] + rel.split(os.sep))
+
+
+def Archive(m, DestRoot, archives, crlf_archives=[], progress=None, jobs=1):
+    # 	Stream the manifest straight into the archives, without writing the
+    # 	distro tree. Returns the per-owner [files, bytes, seconds] written.
+    # 	Each file is read once for all the archives, which are written side
+    # 	by side; tar files are compressed with jobs threads.
+    import release_archives
+
+    totals = OrderedDict((o, [0, 0, 0.0]) for o in m.owners)
+    entries = [(ArchiveName(DestRoot, d), d, None) for d in m.dirs]
+    entries += [(ArchiveName(DestRoot, d), d, f) for d, f in m.files.items()]
+    entries += [(ArchiveName(DestRoot, d), d, f) for d, f in m.symlinks.items()]
+    # 	Sorting by path puts every folder before its content
+    entries.sort(key=lambda e: e[0].split("/"))
+
+    writers = [release_archives.open_archive(a, None, jobs) for a in archives]
+    writers += [release_archives.open_archive(a, "crlf", jobs) for a in crlf_archives]
+    done = [0, 0, len(m.files) + len(m.symlinks), m.size()]
+    with release_archives.FanOut(writers) as out:
+        for name, d, f in entries:
+            t = time.time()
+            if f is None:
+                out.add_dir(name, m.dirs[d])
+                continue
+            out.add_file(name, f[0])
+            size = os.stat(f[0]).st_size
+            totals[f[1]][0] += 1
+            totals[f[1]][1] += size
+            totals[f[1]][2] += time.time() - t
+            if progress:
+                done[0] += 1
+                done[1] += size
+                progress(*done)
+    return totals
+
+
+def PrintSummary(m, totals):
+    print("%-32s %8s %14s %9s" % ("Library", "Files", "Bytes", "Seconds"))
+    for owner, (files, size, seconds) in totals.items():
+        print("%-32s %8d %14d %9.2f" % (owner, files, size, seconds))
     print(
-        "The destination directory already exists. Renaming it, so that a new one can be generated.\n"
+        "%-32s %8d %14d %9.2f"
+        % (
+            "Total",
+            sum(t[0] for t in totals.values()),
+            sum(t[1] for t in totals.values()),
+            sum(t[2] for t in totals.values()),
+        )
     )
-    timestamp1 = datetime.datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
-    os.rename(DestRoot, DestRoot + "_bck_" + timestamp1)
-
-if not os.path.exists(DestRoot):
-    print("Creating destination directory %s" % DestRoot)
-    os.makedirs(DestRoot)
-
-DestHeaders = os.path.join(DestRoot, BoostHeaders)
-DestLibs = os.path.join(DestRoot, BoostLibs)
-os.makedirs(DestHeaders)
-os.makedirs(DestLibs)
-
-## Step 1
-for f in os.listdir(SourceRoot):
-    if f != "CMakeLists.txt":
-        CopyFile(SourceRoot, DestRoot, f)
-
-## Step 2
-for d in BoostSpecialFolders:
-    CopyDir(SourceRoot, DestRoot, d)
-
-## Step 3
-SourceLibs = os.path.join(SourceRoot, BoostLibs)
-for f in os.listdir(SourceLibs):
-    CopyFile(SourceLibs, DestLibs, f)
-
-## Step 4
-BoostSubProjects = set()
-for f in os.listdir(SourceLibs):
-    if os.path.isdir(os.path.join(SourceLibs, f)):
-        if os.path.isfile(os.path.join(SourceLibs, f, "meta", "libraries.json")):
-            BoostSubProjects.add(f)
-        elif os.path.isdir(os.path.join(SourceLibs, f, "include")):
-            BoostSubProjects.add(f)
-        elif f == "headers":
-            BoostSubProjects.add(f)
-        elif os.path.isfile(os.path.join(SourceLibs, f, "sublibs")):
-            for s in os.listdir(os.path.join(SourceLibs, f)):
-                if os.path.isdir(os.path.join(SourceLibs, f, s)):
-                    if os.path.isfile(
-                        os.path.join(SourceLibs, f, s, "meta", "libraries.json")
-                    ):
-                        BoostSubProjects.add((f, s))
-                    elif os.path.isdir(os.path.join(SourceLibs, f, s, "include")):
-                        BoostSubProjects.add((f, s))
-
-for p in BoostSubProjects:
-    if isinstance(p, six.string_types):
-        CopySubProject(SourceLibs, DestLibs, DestHeaders, p)
+    print("%d folders, %d header conflicts" % (len(m.dirs), len(m.conflicts)))
+
+
+def IndexHeaders(m, SourceRoot, DestRoot, filename):
+    # 	The HeaderIndex of m, reporting what changed since the one in filename
+    previous = HeaderIndex.load(filename)
+    index = HeaderIndex.build(m, SourceRoot, DestRoot, previous)
+    if previous.headers:
+        changed, moved = index.changes(previous)
+        print("\n## Libraries with changed headers: %d" % len(changed))
+        for library in changed:
+            print("  %s" % library)
+        for header, old, new in moved:
+            print("## %s moved from %s to %s" % (header, old, new))
+    return index
+
+
+class DistroResult(object):
+    """
+    What main() planned and wrote: the manifest, the per-library
+    [files, bytes, seconds] totals, and the plan/execute wall times.
+    """
+
+    def __init__(self, manifest, totals, timings):
+        self.manifest = manifest
+        self.totals = totals
+        self.timings = timings
+
+    @property
+    def files(self):
+        return sum(t[0] for t in self.totals.values())
+
+    @property
+    def bytes(self):
+        return sum(t[1] for t in self.totals.values())
+
+    @property
+    def conflicts(self):
+        return self.manifest.conflicts
+
+
+def main(
+    SourceRoot,
+    DestRoot,
+    jobs=1,
+    link="copy",
+    dry_run=False,
+    incremental=False,
+    progress=None,
+    archives=[],
+    crlf_archives=[],
+    overlays=[],
+    header_index=None,
+):
+    """
+    Build the distro of the boost checkout SourceRoot in DestRoot and
+    return a DistroResult. See the top of this file for the options.
+
+    With archives, a list of .tar.gz, .tar.bz2, .tar.zst, .tar, .zip or
+    .7z file names, the distro is written to those archives, under a folder
+    named after DestRoot, instead of to DestRoot itself. The text files in
+    crlf_archives get CRLF line endings.
+
+    overlays is a list of (source, path relative to DestRoot) files and
+    folders written over the distro.
+
+    header_index names a HeaderIndex JSON file, updated with the owners of
+    the headers of the distro, unless dry_run is set. With incremental,
+    the headers of the libraries that did not change since the previous
+    index are not compared with the distro again, if that index was
+    saved by a run that wrote DestRoot itself, and not archives.
+    """
+    global CopyMode
+    CopyMode = link
+
+    print("Source = %s" % SourceRoot)
+    print("Dest   = %s" % DestRoot)
+
+    if not os.path.exists(SourceRoot):
+        raise OSError(errno.ENOENT, os.strerror(errno.ENOENT), SourceRoot)
+
+    timings = OrderedDict()
+    t = time.time()
+    if dry_run:
+        m = Plan(SourceRoot, DestRoot)
+        AddOverlays(m, DestRoot, overlays)
+        timings["plan"] = time.time() - t
+        result = DistroResult(m, m.summary(), timings)
+        PrintSummary(m, result.totals)
+        if header_index:
+            IndexHeaders(m, SourceRoot, DestRoot, header_index)
+        return result
+
+    if archives or crlf_archives:
+        m = Plan(SourceRoot, DestRoot)
+        AddOverlays(m, DestRoot, overlays)
+        timings["plan"] = time.time() - t
+        t = time.time()
+        totals = Archive(m, DestRoot, archives, crlf_archives, progress, jobs)
+        timings["archive"] = time.time() - t
+        PrintSummary(m, totals)
+        if header_index:
+            IndexHeaders(m, SourceRoot, DestRoot, header_index).save(header_index)
+        return DistroResult(m, totals, timings)
+
+    if os.path.isdir(DestRoot) and incremental:
+        print("Updating the existing destination directory %s" % DestRoot)
     else:
-        NestedSource = os.path.join(SourceRoot, "libs", p[0])
-        NestedDest = os.path.join(DestRoot, "libs", p[0])
-        NestedHeaders = os.path.join(DestRoot, "boost")
-        if not os.path.exists(NestedDest):
-            os.makedirs(NestedDest)
-        if not os.path.exists(NestedHeaders):
-            os.makedirs(NestedHeaders)
-        for f in os.listdir(NestedSource):
-            CopyFile(NestedSource, NestedDest, f)
-        CopyNestedProject(NestedSource, NestedDest, NestedHeaders, p)
+        incremental = False
+        if os.path.exists(DestRoot):
+            print(
+                "The destination directory already exists. Renaming it, so that a new one can be generated.\n"
+            )
+            timestamp1 = datetime.datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+            os.rename(DestRoot, DestRoot + "_bck_" + timestamp1)
+
+        if not os.path.exists(DestRoot):
+            print("Creating destination directory %s" % DestRoot)
+
+    m = Plan(SourceRoot, DestRoot)
+    AddOverlays(m, DestRoot, overlays)
+    timings["plan"] = time.time() - t
+    trusted = ()
+    if header_index:
+        t = time.time()
+        index = IndexHeaders(m, SourceRoot, DestRoot, header_index)
+        if incremental:
+            trusted = index.trusted(HeaderIndex.load(header_index), DestRoot)
+        timings["index"] = time.time() - t
+    t = time.time()
+    totals = Execute(m, jobs, DestRoot if incremental else None, progress, trusted)
+    timings["execute"] = time.time() - t
+    PrintSummary(m, totals)
+    if header_index:
+        # 	Only now are the headers known to be in DestRoot
+        index.distro = os.path.realpath(DestRoot)
+        index.save(header_index)
+    return DistroResult(m, totals, timings)
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="usage: %prog [options] source dest")
+    parser.add_option(
+        "-j",
+        "--jobs",
+        default=1,
+        type="int",
+        help="number of files to copy concurrently (default 1)",
+        dest="jobs",
+    )
+    parser.add_option(
+        "--link",
+        default="copy",
+        type="choice",
+        choices=["copy", "hardlink", "reflink"],
+        help="copy, hardlink or reflink the files into dest (default copy)",
+        dest="link",
+    )
+    parser.add_option(
+        "-n",
+        "--dry-run",
+        default=False,
+        action="store_true",
+        help="print the plan and its size, but do not write anything",
+        dest="dryrun",
+    )
+    parser.add_option(
+        "-i",
+        "--incremental",
+        default=False,
+        action="store_true",
+        help="update an existing dest in place, copying only what changed",
+        dest="incremental",
+    )
+    parser.add_option(
+        "-a",
+        "--archive",
+        default=[],
+        action="append",
+        help="write the distro to this .tar.gz, .tar.bz2, .tar.zst, .tar, .zip or "
+        ".7z file instead of to dest, which only names the folder in the archive; "
+        "may be given more than once",
+        dest="archives",
+    )
+    parser.add_option(
+        "--crlf-archive",
+        default=[],
+        action="append",
+        help="like --archive, but with CRLF line endings in text files",
+        dest="crlf_archives",
+    )
+    parser.add_option(
+        "--header-index",
+        default=None,
+        help="JSON file recording which library each boost/ header comes "
+        "from; updated on each run",
+        dest="header_index",
+    )
+    (options, args) = parser.parse_args()
+    if len(args) != 2:
+        parser.print_help()
+        exit(1)
+
+    if not os.path.exists(args[0]):
+        print("## Error: %s does not exist" % args[0])
+        exit(1)
+
+    main(
+        args[0],
+        args[1],
+        jobs=options.jobs,
+        link=options.link,
+        dry_run=options.dryrun,
+        incremental=options.incremental,
+        archives=options.archives,
+        crlf_archives=options.crlf_archives,
+        header_index=options.header_index,
+    )
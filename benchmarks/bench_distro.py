@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+#
+# Distributed under the Boost Software License, Version 1.0.
+# (See accompanying file LICENSE_1_0.txt or copy at
+# http://www.boost.org/LICENSE_1_0.txt)
+#
+# Measure the ways of staging a release distro: MakeBoostDistro.py with
+# each --link mode, with --jobs, --incremental and --archive, and the
+# tree_walk.mergetree copy of mergeTree.py and snapshot.py.
+#
+# ./benchmarks/bench_distro.py ~/boost /tmp/bench
+#
+# stages ~/boost into folders and archives of /tmp/bench. Without a source
+# tree, a synthetic one is made first with make_boost_tree.py:
+#
+# ./benchmarks/bench_distro.py --generate /tmp/bench
+#
+# Each strategy runs in its own process, so that its peak RSS is its own,
+# and files/sec, bytes/sec and the peak RSS are reported. --save writes
+# the results to a JSON file, which --compare then checks a later run
+# against, failing if a strategy got slower than --tolerance allows.
+
+from __future__ import print_function
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import resource
+import subprocess
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Strategy name -> MakeBoostDistro.main arguments, or None for mergetree.
+# "{jobs}" stands for the --jobs option.
+Strategies = [
+    ("copy", {}),
+    ("copy-j{jobs}", {"jobs": "{jobs}"}),
+    ("hardlink-j{jobs}", {"jobs": "{jobs}", "link": "hardlink"}),
+    ("reflink-j{jobs}", {"jobs": "{jobs}", "link": "reflink"}),
+    ("incremental-j{jobs}", {"jobs": "{jobs}", "incremental": True}),
+    ("archive-tar.gz", {"archives": [".tar.gz"]}),
+    ("archive-zip", {"archives": [".zip"]}),
+    ("mergetree", None),
+]
+
+
+def peak_rss():
+    # 	ru_maxrss is in kilobytes on Linux, in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return rss
+    return rss * 1024
+
+
+def tree_size(path):
+    import tree_walk
+
+    files = 0
+    size = 0
+    for dirpath, dirs, entries in tree_walk.walk(path):
+        for e in entries:
+            files += 1
+            size += e.stat().st_size
+    return files, size
+
+
+def stage(name, source, dest, jobs):
+    """
+    Run the strategy name, staging source in dest, and return its
+    measurements. This is what the child processes do.
+    """
+    import MakeBoostDistro
+    import tree_walk
+
+    arguments = dict((n.format(jobs=jobs), a) for n, a in Strategies)[name]
+    saved = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        t = time.time()
+        if arguments is None:
+            tree_walk.mergetree(source, dest, ignore=MakeBoostDistro.IgnoreFiles)
+            t = time.time() - t
+            files, size = tree_size(dest)
+        else:
+            arguments = dict(arguments)
+            if "jobs" in arguments:
+                arguments["jobs"] = jobs
+            if "archives" in arguments:
+                arguments["archives"] = [dest + s for s in arguments["archives"]]
+            result = MakeBoostDistro.main(source, dest, **arguments)
+            t = time.time() - t
+            files, size = result.files, result.bytes
+            if "incremental" in arguments:
+                # 	What was found up to date was not written, but staged
+                files, size = len(result.manifest.files), result.manifest.size()
+    finally:
+        sys.stdout = saved
+    return {
+        "files": files,
+        "bytes": size,
+        "seconds": t,
+        "files/sec": files / max(t, 1e-9),
+        "bytes/sec": size / max(t, 1e-9),
+        "peak rss": peak_rss(),
+    }
+
+
+def run(name, source, dest, jobs):
+    output = subprocess.check_output(
+        [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--child",
+            name,
+            "--jobs",
+            str(jobs),
+            source,
+            dest,
+        ]
+    )
+    return json.loads(output.decode("utf-8").splitlines()[-1])
+
+
+def remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def report(name, r):
+    print(
+        "%-20s %8d files %14d bytes %8.2fs %10.0f files/s %8.1f MB/s %8.1f MB peak RSS"
+        % (
+            name,
+            r["files"],
+            r["bytes"],
+            r["seconds"],
+            r["files/sec"],
+            r["bytes/sec"] / 1e6,
+            r["peak rss"] / 1e6,
+        )
+    )
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="usage: %prog [options] [source] workdir")
+    parser.add_option(
+        "-j",
+        "--jobs",
+        default=8,
+        type="int",
+        help="--jobs of the concurrent strategies (default 8)",
+        dest="jobs",
+    )
+    parser.add_option(
+        "-s",
+        "--strategy",
+        default=[],
+        action="append",
+        help="strategy to run, may be repeated (default all of them)",
+        dest="strategies",
+    )
+    parser.add_option(
+        "-r",
+        "--repeat",
+        default=3,
+        type="int",
+        help="number of runs of each strategy; the fastest is reported (default 3)",
+        dest="repeat",
+    )
+    parser.add_option(
+        "--generate",
+        default=False,
+        action="store_true",
+        help="stage a synthetic tree made in workdir by make_boost_tree.py",
+        dest="generate",
+    )
+    parser.add_option(
+        "--libraries",
+        default=100,
+        type="int",
+        help="number of libraries of the synthetic tree (default 100)",
+        dest="libraries",
+    )
+    parser.add_option(
+        "--save",
+        default=None,
+        help="write the results to this JSON file",
+        dest="save",
+    )
+    parser.add_option(
+        "--compare",
+        default=None,
+        help="compare the results with those saved in this JSON file",
+        dest="compare",
+    )
+    parser.add_option(
+        "--tolerance",
+        default=0.2,
+        type="float",
+        help="slowdown in files/sec over the --compare results that fails the "
+        "benchmark (default 0.2, i.e. 20%)",
+        dest="tolerance",
+    )
+    parser.add_option("--child", default=None, help="(internal)", dest="child")
+    (options, args) = parser.parse_args()
+
+    if options.child:
+        print(json.dumps(stage(options.child, args[0], args[1], options.jobs)))
+        exit(0)
+
+    if options.generate and len(args) == 1:
+        import make_boost_tree
+
+        workdir = args[0]
+        source = os.path.join(workdir, "boost")
+        remove(source)
+        t = make_boost_tree.generate(source, libraries=options.libraries)
+        print("Generated %d files, %d bytes in %s" % (t.files, t.bytes, source))
+    elif not options.generate and len(args) == 2:
+        source, workdir = args
+    else:
+        parser.print_help()
+        exit(1)
+
+    names = [name.format(jobs=options.jobs) for name, a in Strategies]
+    for name in options.strategies:
+        if name not in names:
+            print("## Error: unknown strategy %s, use one of %s" % (name, names))
+            exit(1)
+
+    results = {}
+    for name in names:
+        if options.strategies and name not in options.strategies:
+            continue
+        dest = os.path.join(workdir, "distro")
+        best = None
+        for i in range(options.repeat):
+            for suffix in ["", ".tar.gz", ".zip"]:
+                remove(dest + suffix)
+            if name.startswith("incremental"):
+                # 	Measure an update of an up to date distro
+                run("copy", source, dest, options.jobs)
+            r = run(name, source, dest, options.jobs)
+            if best is None or r["seconds"] < best["seconds"]:
+                best = r
+        for suffix in ["", ".tar.gz", ".zip"]:
+            remove(dest + suffix)
+        results[name] = best
+        report(name, best)
+
+    if options.save:
+        with open(options.save, "w") as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+
+    if options.compare:
+        with open(options.compare, "r") as f:
+            baseline = json.load(f)
+        failed = False
+        print("")
+        for name in sorted(set(results) & set(baseline)):
+            ratio = results[name]["files/sec"] / max(baseline[name]["files/sec"], 1e-9)
+            slower = ratio < 1 - options.tolerance
+            failed = failed or slower
+            print(
+                "%-20s %6.2fx the files/sec of %s%s"
+                % (name, ratio, options.compare, "  ## slower" if slower else "")
+            )
+        if failed:
+            exit(1)
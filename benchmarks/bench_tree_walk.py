@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+#
+# Distributed under the Boost Software License, Version 1.0.
+# (See accompanying file LICENSE_1_0.txt or copy at
+# http://www.boost.org/LICENSE_1_0.txt)
+#
+# Compare the tree walk MakeBoostDistro.py used to do (os.listdir, then an
+# os.path.isdir and os.stat per entry, and shutil.ignore_patterns per name)
+# with tree_walk.walk (os.scandir and one compiled ignore matcher).
+#
+# Only the walk is measured, nothing is copied. Run it on a boost checkout:
+#
+# ./benchmarks/bench_tree_walk.py ~/boost
+#
+# The system call counts are those made through os.listdir, os.scandir,
+# os.stat, os.lstat and os.DirEntry.stat, which is where the two walks
+# differ.
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import shutil
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tree_walk
+
+Patterns = (
+    "[.]*",
+    "[.]gitattributes",
+    "[.]gitignore",
+    "[.]gitmodules",
+    "[.]travis[.]yml",
+    "appveyor[.]yml",
+    "circle[.]yml",
+)
+
+
+class Counter(object):
+    """Counts the calls made to some functions of the os module."""
+
+    names = ["listdir", "scandir", "stat", "lstat"]
+
+    def __init__(self):
+        self.calls = dict((name, 0) for name in self.names)
+        self.saved = {}
+
+    def __enter__(self):
+        for name in self.names:
+            self.saved[name] = getattr(os, name)
+            setattr(os, name, self.wrap(name, self.saved[name]))
+        return self
+
+    def __exit__(self, *exc):
+        for name in self.names:
+            setattr(os, name, self.saved[name])
+
+    def wrap(self, name, f):
+        def counted(*args, **kargs):
+            self.calls[name] += 1
+            return f(*args, **kargs)
+
+        return counted
+
+    def total(self):
+        return sum(self.calls.values())
+
+
+def legacy_walk(src, ignore, counter):
+    files = 0
+    size = 0
+    names = os.listdir(src)
+    for name in names:
+        if len(ignore(src, [name])) > 0:
+            continue
+        s = os.path.join(src, name)
+        if os.path.isdir(s):
+            f, b = legacy_walk(s, ignore, counter)
+            files += f
+            size += b
+        else:
+            files += 1
+            size += os.stat(s).st_size
+    return files, size
+
+
+def scandir_walk(src, ignore, counter):
+    files = 0
+    size = 0
+    for dirpath, dirs, entries in tree_walk.walk(src, ignore):
+        for e in entries:
+            counter.calls["stat"] += 1  # DirEntry.stat
+            files += 1
+            size += e.stat().st_size
+    return files, size
+
+
+def run(name, walker, ignore, src, repeat):
+    best = None
+    for i in range(repeat):
+        with Counter() as counter:
+            t = time.time()
+            files, size = walker(src, ignore, counter)
+            t = time.time() - t
+        if best is None or t < best[0]:
+            best = (t, counter)
+    t, counter = best
+    print(
+        "%-10s %8d files %14d bytes %9.3fs %10d calls (%s)"
+        % (
+            name,
+            files,
+            size,
+            t,
+            counter.total(),
+            ", ".join("%s %d" % (k, counter.calls[k]) for k in Counter.names),
+        )
+    )
+    return t, counter.total()
+
+
+usage = "usage: %prog [options] tree"
+parser = OptionParser(usage=usage)
+parser.add_option(
+    "-r",
+    "--repeat",
+    default=3,
+    type="int",
+    help="number of runs of each walk; the fastest is reported (default 3)",
+    dest="repeat",
+)
+(options, args) = parser.parse_args()
+if len(args) != 1:
+    parser.print_help()
+    exit(1)
+
+legacy = run(
+    "listdir", legacy_walk, shutil.ignore_patterns(*Patterns), args[0], options.repeat
+)
+scandir = run(
+    "scandir",
+    scandir_walk,
+    tree_walk.IgnorePatterns(*Patterns),
+    args[0],
+    options.repeat,
+)
+print(
+    "scandir: %.1fx faster, %.1fx fewer calls"
+    % (legacy[0] / max(scandir[0], 1e-9), float(legacy[1]) / max(scandir[1], 1))
+)
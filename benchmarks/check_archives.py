@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+#
+# Distributed under the Boost Software License, Version 1.0.
+# (See accompanying file LICENSE_1_0.txt or copy at
+# http://www.boost.org/LICENSE_1_0.txt)
+#
+# Check the release archives that release_archives.py writes:
+#
+# ./benchmarks/check_archives.py ~/boost /tmp/check
+#
+# writes archives of ~/boost in /tmp/check. Without a source tree, a
+# synthetic one is made first with make_boost_tree.py:
+#
+# ./benchmarks/check_archives.py /tmp/check
+#
+# filter_archive must give the same entries as archive_tree writes to a
+# nodocs archive, for every kind of archive it reads, the multi-member
+# gzip and multi-stream bzip2 ones included. The reproducible archives of
+# a tree, written with one thread and with --jobs threads, must be the
+# same files. The exit status is 1 if a check failed.
+
+from __future__ import print_function
+
+import os
+import sys
+import shutil
+import tarfile
+import zipfile
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import release_archives
+
+# Check name -> archive suffix, threads, seekable. "{jobs}" stands for the
+# --jobs option.
+FilterChecks = [
+    ("filter-tar", ".tar", 1, False),
+    ("filter-tar.gz", ".tar.gz", 1, False),
+    ("filter-tar.gz-j{jobs}", ".tar.gz", "{jobs}", False),
+    ("filter-tar.gz-seekable", ".tar.gz", 1, True),
+    ("filter-tar.bz2-j{jobs}", ".tar.bz2", "{jobs}", False),
+    ("filter-zip", ".zip", 1, False),
+]
+
+
+# The archives that check_reproducible writes
+ReproducibleSuffixes = [".tar", ".tar.gz", ".tar.bz2", ".tar.zst", ".zip"]
+
+
+def names(filename):
+    """The sorted names of the entries of the archive filename."""
+    if filename.endswith(".zip"):
+        with zipfile.ZipFile(filename) as z:
+            return sorted(n.rstrip("/") for n in z.namelist())
+    with tarfile.open(filename) as tar:
+        return sorted(tar.getnames())
+
+
+def check_filter(source, workdir, suffix, threads, seekable):
+    """
+    Filter an archive of source with the docs, and compare it with the
+    nodocs archive of the same scan. Returns an error, or None.
+    """
+    docs = os.path.join(workdir, "docs" + suffix)
+    nodocs = os.path.join(workdir, "nodocs" + suffix)
+    filtered = os.path.join(workdir, "filtered" + suffix)
+    release_archives.archive_tree(
+        source,
+        [docs, nodocs],
+        threads=threads,
+        nodocs=[nodocs],
+        seekable=[docs] if seekable else [],
+    )
+    release_archives.filter_archive(docs, filtered, threads=threads)
+    expected = names(nodocs)
+    found = names(filtered)
+    if found != expected:
+        return "%d entries, %d in the nodocs archive" % (len(found), len(expected))
+    return None
+
+
+def check_reproducible(source, workdir, jobs):
+    """
+    Write the reproducible archives of source with 1 and with jobs
+    threads, and compare them. Returns [(suffix, error or None)].
+    """
+    suffixes = [s for s in ReproducibleSuffixes if release_archives.can_write(s)]
+    hashes = []
+    for threads in [1, jobs]:
+        filenames = [os.path.join(workdir, "%d%s" % (threads, s)) for s in suffixes]
+        release_archives.archive_tree(
+            source, filenames, threads=threads, mtime=1600000000
+        )
+        hashes.append([release_archives.file_sha256(f) for f in filenames])
+    results = []
+    for s, one, many in zip(suffixes, hashes[0], hashes[1]):
+        error = None
+        if one != many:
+            error = "sha256 %s with 1 thread, %s with %d" % (one, many, jobs)
+        results.append((s, error))
+    return results
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="usage: %prog [options] [source] workdir")
+    parser.add_option(
+        "-j",
+        "--jobs",
+        default=4,
+        type="int",
+        help="threads of the multi-threaded archives (default 4)",
+        dest="jobs",
+    )
+    parser.add_option(
+        "--libraries",
+        default=100,
+        type="int",
+        help="number of libraries of the synthetic tree (default 100)",
+        dest="libraries",
+    )
+    (options, args) = parser.parse_args()
+
+    if len(args) == 1:
+        import make_boost_tree
+
+        workdir = args[0]
+        source = os.path.join(workdir, "boost")
+        if os.path.exists(source):
+            shutil.rmtree(source)
+        t = make_boost_tree.generate(source, libraries=options.libraries)
+        print("Generated %d files, %d bytes in %s" % (t.files, t.bytes, source))
+    elif len(args) == 2:
+        source, workdir = args
+    else:
+        parser.print_help()
+        exit(1)
+
+    failed = False
+    archives = os.path.join(workdir, "archives")
+    for name, suffix, threads, seekable in FilterChecks:
+        name = name.format(jobs=options.jobs)
+        if threads == "{jobs}":
+            threads = options.jobs
+        if os.path.exists(archives):
+            shutil.rmtree(archives)
+        os.makedirs(archives)
+        try:
+            error = check_filter(source, archives, suffix, threads, seekable)
+        except Exception as e:
+            error = "%s: %s" % (type(e).__name__, e)
+        failed = failed or error is not None
+        print("%-28s %s" % (name, "ok" if error is None else "## FAILED: " + error))
+    if os.path.exists(archives):
+        shutil.rmtree(archives)
+    os.makedirs(archives)
+    for suffix, error in check_reproducible(source, archives, options.jobs):
+        failed = failed or error is not None
+        name = "reproducible" + suffix
+        print("%-28s %s" % (name, "ok" if error is None else "## FAILED: " + error))
+    shutil.rmtree(archives)
+    if failed:
+        exit(1)
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+#
+# Distributed under the Boost Software License, Version 1.0.
+# (See accompanying file LICENSE_1_0.txt or copy at
+# http://www.boost.org/LICENSE_1_0.txt)
+#
+# Generate a synthetic tree shaped like a boost checkout, for measuring
+# MakeBoostDistro.py and the mergetree helpers without a real one:
+#
+# ./benchmarks/make_boost_tree.py --libraries 150 --headers 40 /tmp/boost
+#
+# The tree has the root files and special folders (doc, more, status,
+# tools) of a checkout, and libraries in libs/ with meta/libraries.json,
+# include/boost, doc, test and example folders. Some libraries are nested
+# below a folder with a "sublibs" file, as libs/numeric is, and some ship
+# headers that another library ships too, so that the header merge has
+# conflicts to report. The same options and seed always give the same
+# tree.
+
+from __future__ import print_function
+
+import os
+import json
+import random
+from optparse import OptionParser
+
+RootFiles = [
+    "Jamroot",
+    "LICENSE_1_0.txt",
+    "README.md",
+    "boost-build.jam",
+    "boostcpp.jam",
+    "index.html",
+    ".gitmodules",
+    ".gitattributes",
+]
+
+
+class TreeMaker(object):
+    """
+    Writes the files of the tree, with a deterministic content of about
+    file_size bytes each, and counts them.
+    """
+
+    def __init__(self, root, file_size=2000, seed=0):
+        self.root = root
+        self.file_size = file_size
+        self.random = random.Random(seed)
+        self.lines = [
+            (
+                "// %s\n"
+                % " ".join("w%d" % self.random.randrange(1000) for j in range(8))
+            )
+            for i in range(512)
+        ]
+        self.files = 0
+        self.bytes = 0
+
+    def text(self, size=None):
+        size = self.random.randint(1, 2 * (size or self.file_size))
+        lines = []
+        length = 0
+        while length < size:
+            line = self.random.choice(self.lines)
+            lines.append(line)
+            length += len(line)
+        return "".join(lines)
+
+    def write(self, path, content=None):
+        path = os.path.join(self.root, path)
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        if content is None:
+            content = self.text()
+        with open(path, "w") as f:
+            f.write(content)
+        self.files += 1
+        self.bytes += len(content)
+
+    def library(self, path, name, include, headers, docs, shared):
+        # 	path is the library folder below libs, include the folder of its
+        # 	headers below boost/
+        self.write(
+            os.path.join(path, "meta", "libraries.json"),
+            json.dumps({"key": name, "name": name, "authors": ["Synthetic"]}, indent=4)
+            + "\n",
+        )
+        self.write(os.path.join(path, "README.md"))
+        self.write(os.path.join(path, "index.html"))
+        self.write(os.path.join(path, ".gitattributes"), "* text=auto\n")
+        self.write(os.path.join(path, ".travis.yml"))
+        self.write(os.path.join(path, "build", "Jamfile.v2"))
+        top = os.path.join(path, "include", "boost")
+        self.write(os.path.join(top, include + ".hpp"))
+        for i in range(headers):
+            self.write(os.path.join(top, include, "h%d.hpp" % i))
+        for i in range(max(1, headers // 10)):
+            self.write(os.path.join(top, include, "detail", "d%d.hpp" % i))
+        self.write(os.path.join(top, "detail", name.replace("/", "_") + ".hpp"))
+        for header in shared:
+            self.write(os.path.join(top, header), "// %s\n" % name)
+        for i in range(docs):
+            self.write(os.path.join(path, "doc", "html", "p%d.html" % i))
+        self.write(os.path.join(path, "doc", "Jamfile.v2"))
+        for i in range(max(1, headers // 4)):
+            self.write(os.path.join(path, "test", "t%d.cpp" % i))
+        for i in range(max(1, headers // 8)):
+            self.write(os.path.join(path, "example", "e%d.cpp" % i))
+
+
+def generate(
+    root,
+    libraries=100,
+    headers=20,
+    sublibs=2,
+    nested=3,
+    docs=10,
+    conflicts=5,
+    file_size=2000,
+    seed=0,
+):
+    """
+    Write a synthetic boost tree in root: libraries top level libraries
+    with about headers headers and docs doc pages each, and sublibs
+    folders of nested libraries with nested libraries each. conflicts
+    headers are shipped by several libraries. Returns the TreeMaker, with
+    the number of files and bytes written.
+    """
+    t = TreeMaker(root, file_size, seed)
+    for name in RootFiles:
+        t.write(name)
+    for folder in ["doc", "more", "status", "tools/build", "tools/quickbook"]:
+        for i in range(docs):
+            t.write(os.path.join(folder, "f%d.html" % i))
+    for name in ["libraries.htm", "maintainers.txt", "index.html"]:
+        t.write(os.path.join("libs", name))
+    t.write(os.path.join("libs", "headers", "build", "Jamfile"))
+
+    shared = ["shared%d.hpp" % i for i in range(conflicts)]
+    for i in range(libraries):
+        name = "lib%d" % i
+        t.library(
+            os.path.join("libs", name),
+            name,
+            name,
+            headers,
+            docs,
+            [h for h in shared if t.random.random() < 0.2],
+        )
+    for i in range(sublibs):
+        group = "group%d" % i
+        t.write(os.path.join("libs", group, "sublibs"), "")
+        t.write(os.path.join("libs", group, "index.html"))
+        for j in range(nested):
+            name = "sub%d" % j
+            t.library(
+                os.path.join("libs", group, name),
+                group + "/" + name,
+                group + "/" + name,
+                headers,
+                docs,
+                [h for h in shared if t.random.random() < 0.2],
+            )
+    return t
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="usage: %prog [options] dest")
+    parser.add_option(
+        "--libraries",
+        default=100,
+        type="int",
+        help="number of top level libraries (default 100)",
+        dest="libraries",
+    )
+    parser.add_option(
+        "--headers",
+        default=20,
+        type="int",
+        help="number of headers per library (default 20)",
+        dest="headers",
+    )
+    parser.add_option(
+        "--sublibs",
+        default=2,
+        type="int",
+        help='number of folders of nested libraries, like "numeric" (default 2)',
+        dest="sublibs",
+    )
+    parser.add_option(
+        "--nested",
+        default=3,
+        type="int",
+        help="number of libraries in each of those folders (default 3)",
+        dest="nested",
+    )
+    parser.add_option(
+        "--docs",
+        default=10,
+        type="int",
+        help="number of doc pages per library and special folder (default 10)",
+        dest="docs",
+    )
+    parser.add_option(
+        "--conflicts",
+        default=5,
+        type="int",
+        help="number of headers shipped by several libraries (default 5)",
+        dest="conflicts",
+    )
+    parser.add_option(
+        "--file-size",
+        default=2000,
+        type="int",
+        help="average file size in bytes (default 2000)",
+        dest="file_size",
+    )
+    parser.add_option(
+        "--seed",
+        default=0,
+        type="int",
+        help="random seed (default 0)",
+        dest="seed",
+    )
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.print_help()
+        exit(1)
+    if os.path.exists(args[0]):
+        print("## Error: %s already exists" % args[0])
+        exit(1)
+
+    t = generate(
+        args[0],
+        options.libraries,
+        options.headers,
+        options.sublibs,
+        options.nested,
+        options.docs,
+        options.conflicts,
+        options.file_size,
+        options.seed,
+    )
+    print("%d files, %d bytes written to %s" % (t.files, t.bytes, args[0]))
@@ -12,13 +12,9 @@ import os.path
 
 from ci_boost_common import main, utils, script_common
 
-# Check python version
-if sys.version_info[0] == 2 :
-    pythonversion="2"
-    pythonbinary="python2"
-else:
-    pythonversion="3"
-    pythonbinary="python3"
+# MakeBoostDistro and tree_walk need os.scandir, from Python 3.5. Older
+# pythons run them in a python3 process instead of importing them.
+import_release_tools = sys.version_info >= (3, 5)
 
 class script(script_common):
 
@@ -46,13 +42,21 @@ class script(script_common):
 
         if self.release:
 
-            os.chdir(self.build_dir)
-            utils.check_call('wget','https://raw.githubusercontent.com/boostorg/release-tools/develop/MakeBoostDistro.py')
-            utils.check_call('chmod','+x','MakeBoostDistro.py')
-
-            os.chdir(self.root_dir)
-            utils.check_call(pythonbinary,os.path.join(self.build_dir,'MakeBoostDistro.py'),
-                self.root_dir, 'release')
+            if import_release_tools:
+                MakeBoostDistro = utils.import_release_tool( 'MakeBoostDistro',
+                    self.build_dir, 'develop', requires=['tree_walk'] )
+
+                os.chdir(self.root_dir)
+                MakeBoostDistro.main( self.root_dir, 'release', jobs=self.jobs )
+            else:
+                utils.makedirs( self.build_dir )
+                for name in ['tree_walk.py', 'MakeBoostDistro.py']:
+                    utils.web_get( 'https://raw.githubusercontent.com/boostorg/release-tools/develop/%s' % (name),
+                        os.path.join( self.build_dir, name ) )
+
+                os.chdir(self.root_dir)
+                utils.check_call( 'python3', os.path.join( self.build_dir, 'MakeBoostDistro.py' ),
+                    '--jobs', str(self.jobs), self.root_dir, 'release' )
 
             self.root_dir = os.path.join( self.root_dir, 'release' )
 
@@ -19,6 +19,7 @@ import subprocess
 import codecs
 import shutil
 import threading
+import importlib
 import distutils.dir_util
 
 # For urllib
@@ -129,11 +130,13 @@ class utils:
     def web_get(source_url, destination_file, proxy=None):
         import urllib.request, urllib.parse, urllib.error
 
-        proxies = None
+        handlers = []
         if proxy is not None:
-            proxies = {"https": proxy, "http": proxy}
+            handlers.append(
+                urllib.request.ProxyHandler({"https": proxy, "http": proxy})
+            )
 
-        src = urllib.request.urlopen(source_url, proxies=proxies)
+        src = urllib.request.build_opener(*handlers).open(source_url)
 
         f = open(destination_file, "wb")
         while True:
@@ -145,6 +148,28 @@ class utils:
         f.close()
         src.close()
 
+    @staticmethod
+    def import_release_tool(module, download_dir, branch="master", requires=[]):
+        """
+        Import one of the release-tools scripts, e.g. MakeBoostDistro, so
+        it runs in this process. They are normally found next to the
+        ci_boost_*.py scripts. If not, they are downloaded from github,
+        along with the modules they require, into download_dir.
+        """
+        try:
+            return importlib.import_module(module)
+        except ImportError:
+            pass
+        utils.makedirs(download_dir)
+        for name in requires + [module]:
+            utils.web_get(
+                "https://raw.githubusercontent.com/boostorg/release-tools/%s/%s.py"
+                % (branch, name),
+                os.path.join(download_dir, name + ".py"),
+            )
+        sys.path.insert(0, download_dir)
+        return importlib.import_module(module)
+
     @staticmethod
     def unpack_archive(archive_path):
         utils.log('Unpacking archive ("%s")...' % archive_path)
@@ -152,12 +177,31 @@ class utils:
         archive_name = os.path.basename(archive_path)
         extension = archive_name[archive_name.find(".") :]
 
-        if extension in (".tar.gz", ".tar.bz2"):
+        if extension in (".tar.gz", ".tar.bz2", ".tar.zst"):
             import tarfile
             import stat
 
-            mode = os.path.splitext(extension)[1][1:]
-            tar = tarfile.open(archive_path, "r:%s" % mode)
+            process = None
+            if extension == ".tar.zst":
+                # tarfile does not read zstd, so read the tar as a stream
+                try:
+                    import zstandard
+
+                    # Through all the frames, as zstd -dc reads them
+                    stream = zstandard.ZstdDecompressor().stream_reader(
+                        open(archive_path, "rb"),
+                        read_across_frames=True,
+                        closefd=True,
+                    )
+                except ImportError:
+                    process = subprocess.Popen(
+                        ["zstd", "-dc", archive_path], stdout=subprocess.PIPE
+                    )
+                    stream = process.stdout
+                tar = tarfile.open(fileobj=stream, mode="r|")
+            else:
+                mode = os.path.splitext(extension)[1][1:]
+                tar = tarfile.open(archive_path, "r:%s" % mode)
             for tarinfo in tar:
                 tar.extract(tarinfo)
                 if sys.platform == "win32" and not tarinfo.isdir():
@@ -167,6 +211,14 @@ class utils:
                     os.chmod(f, stat.S_IWRITE)
                     os.utime(f, (tarinfo.mtime, tarinfo.mtime))
             tar.close()
+            if process:
+                process.stdout.close()
+                if process.wait() != 0:
+                    raise SystemCallError(
+                        ["zstd", "-dc", archive_path], process.returncode
+                    )
+            elif extension == ".tar.zst":
+                stream.close()
         elif extension in (".zip"):
             import zipfile
 
@@ -214,6 +266,32 @@ class parallel_call(threading.Thread):
             raise SystemCallError(self.command, self.result)
 
 
+class parallel_function(threading.Thread):
+    """
+    Like parallel_call, for a python function. join raises what the
+    function raised.
+    """
+
+    def __init__(self, function, *args, **kargs):
+        super(parallel_function, self).__init__()
+        self.function = function
+        self.args = args
+        self.kargs = kargs
+        self.error = None
+        self.start()
+
+    def run(self):
+        try:
+            self.result = self.function(*self.args, **self.kargs)
+        except Exception as error:
+            self.error = error
+
+    def join(self):
+        super(parallel_function, self).join()
+        if self.error is not None:
+            raise self.error
+
+
 class script_common(object):
     """
     Main script to run Boost C++ Libraries continuous integration.
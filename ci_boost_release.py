@@ -23,7 +23,13 @@ import pprint
 from collections import defaultdict
 import re
 
-from ci_boost_common import main, utils, script_common, parallel_call
+from ci_boost_common import (
+    main,
+    utils,
+    script_common,
+    parallel_call,
+    parallel_function,
+)
 
 # Check python version
 if sys.version_info[0] == 2:
@@ -315,6 +321,14 @@ class script(script_common):
         )
         self.releases_dir = None
 
+        opt.add_option(
+            "--force",
+            help="package and upload even if the snapshot did not change",
+            action="store_true",
+            default=False,
+        )
+        self.force = False
+
         return kargs
 
     def start(self):
@@ -415,6 +429,181 @@ class script(script_common):
             "HEAD",
         )
 
+    # Tools whose versions go into the snapshot fingerprint, with the
+    # command that prints them.
+    fingerprint_tools = [
+        ["doxygen", "--version"],
+        ["xsltproc", "--version"],
+        ["asciidoctor", "--version"],
+        ["java", "-version"],
+        ["node", "--version"],
+        # The antora the docs build installs is pinned by the
+        # website-v2-docs commit, this is one installed globally, if any
+        ["npx", "--no", "antora", "--version"],
+        [pythonbinary, "-c", "import docutils; print(docutils.__version__)"],
+    ]
+
+    # The release scripts, found next to this one
+    fingerprint_scripts = [
+        "ci_boost_common.py",
+        "ci_boost_release.py",
+        "MakeBoostDistro.py",
+        "release_archives.py",
+        "tree_walk.py",
+    ]
+
+    # The repository of the Antora docs and UI that command_build builds
+    website_docs_url = "https://github.com/boostorg/website-v2-docs.git"
+
+    def website_docs_branch(self):
+        """
+        The branch of website-v2-docs the docs are built from: master for
+        the master branch, develop for the others. The branch is taken
+        from the checkout, if it was not given.
+        """
+        if self.branch is None:
+            self.branch = "develop"
+            output = subprocess.check_output(
+                ["git", "branch", "--show-current"], cwd=self.root_dir
+            ).decode("utf-8")
+            lines = output.split("\n")
+            for line in lines:
+                if len(line) > 0:
+                    current_branch = line
+                    self.branch = current_branch
+                    break
+        if self.branch == "master":
+            return "master"
+        return "develop"
+
+    def snapshot_fingerprint(self):
+        """
+        A hash of everything the packages are made from: the superproject
+        tree, which holds the submodule commits, the commits checked out
+        in the submodules, the head of the website-v2-docs branch the
+        Antora docs are built from, the doc tools and the release scripts.
+        """
+        if getattr(self, "fingerprint", None):
+            return self.fingerprint
+        h = hashlib.sha256()
+
+        def add(*lines):
+            for line in lines:
+                h.update((line.rstrip() + "\n").encode("utf-8"))
+
+        add(self.boost_version, self.eol)
+        for command in [
+            ["git", "rev-parse", "HEAD^{tree}"],
+            ["git", "submodule", "--quiet", "status", "--recursive"],
+            [
+                "git",
+                "ls-remote",
+                self.website_docs_url,
+                "refs/heads/%s" % (self.website_docs_branch()),
+            ],
+        ]:
+            add(
+                subprocess.check_output(
+                    command, cwd=self.root_dir, universal_newlines=True
+                )
+            )
+        for command in self.fingerprint_tools:
+            try:
+                output = subprocess.run(
+                    command,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    universal_newlines=True,
+                ).stdout
+                add(" ".join(command), (output.splitlines() or [""])[0])
+            except OSError:
+                add(" ".join(command), "missing")
+        scripts_dir = os.path.dirname(os.path.abspath(__file__))
+        for name in self.fingerprint_scripts:
+            path = os.path.join(scripts_dir, name)
+            if os.path.isfile(path):
+                with open(path, "rb") as f:
+                    add(name, hashlib.sha256(f.read()).hexdigest())
+        self.fingerprint = h.hexdigest()
+        utils.log("Snapshot fingerprint: %s" % (self.fingerprint))
+        return self.fingerprint
+
+    def published_fingerprint(self, archive_file):
+        """The fingerprint in the published .json sidecar of archive_file."""
+        sidecar = os.path.join(self.build_dir, "published-%s.json" % (archive_file))
+        try:
+            utils.makedirs(self.build_dir)
+            utils.web_get(
+                "https://archives.boost.io/%s/%s.json" % (self.branch, archive_file),
+                sidecar,
+            )
+            with open(sidecar, "r") as f:
+                return json.load(f).get("fingerprint")
+        except Exception as error:
+            utils.log("No published %s.json: %s" % (archive_file, error))
+            return None
+
+    def package_suffixes(self):
+        """
+        The suffixes of the packages made for the EOL style of this build.
+        The .tar.zst package is only made where zstd can be written.
+        """
+        if self.eol == "LF":
+            release_archives = utils.import_release_tool(
+                "release_archives", self.build_dir, "master", requires=["tree_walk"]
+            )
+            suffixes = [".tar.gz", ".tar.bz2"]
+            if release_archives.can_write(".tar.zst"):
+                suffixes.append(".tar.zst")
+            return suffixes
+        if self.eol == "CRLF":
+            return [".zip", ".7z"]
+        return []
+
+    def package_files(self, docs=True, nodocs=True):
+        """
+        The names of the packages made for the EOL style of this build,
+        with the docs, and without them, as the -nodocs packages.
+        """
+        variants = []
+        if docs:
+            variants.append("")
+        if nodocs:
+            variants.append("-nodocs")
+        return [
+            "%s%s%s%s" % (self.boost_release_name, self.archive_tag, variant, suffix)
+            for suffix in self.package_suffixes()
+            for variant in variants
+        ]
+
+    def seekable_files(self):
+        """
+        The packages with the docs that come with an index, for serving
+        single files out of them; see release_archives.archive_index.
+        """
+        return [
+            f
+            for f in self.package_files(nodocs=False)
+            if f.endswith((".zip", ".tar.gz"))
+        ]
+
+    def snapshot_unchanged(self):
+        """
+        True if the snapshot packages of this build were already published
+        for the same fingerprint, so that they need not be made again.
+        """
+        if self.force or self.mode != "build":
+            return False
+        if self.branch not in ["master", "develop"]:
+            return False
+        if not hasattr(self, "unchanged"):
+            fingerprint = self.snapshot_fingerprint()
+            self.unchanged = all(
+                self.published_fingerprint(archive_file) == fingerprint
+                for archive_file in self.package_files()
+            )
+        return self.unchanged
+
     def command_build(self):
         super(script, self).command_build()
         # Build a packaged release. This involves building a fresh set
@@ -423,6 +612,16 @@ class script(script_common):
         # extra stuff in the archives. Which means that we reset the git
         # tree state to cleanup after building.
 
+        # Nothing to do if the same snapshot was published already. The
+        # fingerprint is taken now, while the checkout is still clean.
+        self.snapshot_fingerprint()
+        if self.snapshot_unchanged():
+            utils.log(
+                "ci_boost_release: snapshot unchanged since the last published "
+                "one, not building the packages (use --force to build them)"
+            )
+            return
+
         # Set up where we will "install" built tools.
         utils.makedirs(os.path.join(self.build_dir, "dist", "bin"))
         os.environ["PATH"] = (
@@ -580,25 +779,10 @@ class script(script_common):
 
         # Build antora docs
         ## Determine the boost branch for which the antora script should
-        ## generate the documentation
+        ## generate the documentation, and the branch of website-v2-docs
+        ## to use, as the snapshot fingerprint does
         os.chdir(self.root_dir)
-        if self.branch is None:
-            self.branch = "develop"
-            output = subprocess.check_output(
-                ["git", "branch", "--show-current"]
-            ).decode("utf-8")
-            lines = output.split("\n")
-            for line in lines:
-                if len(line) > 0:
-                    current_branch = line
-                    self.branch = current_branch
-                    break
-
-        ## Determine the branch of website-v2-docs to use
-        if self.branch == "master":
-            checkout_branch = "master"
-        else:
-            checkout_branch = "develop"
+        checkout_branch = self.website_docs_branch()
 
         # Set the environment variable BOOST_SRC_DIR to the root directory
         # so that the following scripts can find the boost source code
@@ -614,7 +798,7 @@ class script(script_common):
                 "clone",
                 "--depth=1",
                 "--branch=%s" % checkout_branch,
-                "https://github.com/boostorg/website-v2-docs.git",
+                self.website_docs_url,
                 "antora",
             )
         os.chdir(antora_dir)
@@ -649,27 +833,24 @@ class script(script_common):
         elif not os.path.isabs(self.releases_dir):
             self.releases_dir = os.path.join(self.root_dir, self.releases_dir)
             utils.makedirs(self.releases_dir)
-        if os.path.isfile("MakeBoostDistro.py"):
-            import MakeBoostDistro
+        MakeBoostDistro = utils.import_release_tool(
+            "MakeBoostDistro", self.build_dir, "master", requires=["tree_walk"]
+        )
 
-            os.chdir(self.releases_dir)
-            MakeBoostDistro.main(self.root_dir, self.boost_release_name)
-        else:
-            os.chdir(os.path.join(self.build_dir))
-            utils.check_call(
-                "wget",
-                "https://raw.githubusercontent.com/boostorg/release-tools/master/MakeBoostDistro.py",
-                "-O",
-                "MakeBoostDistro.py",
-            )
-            utils.check_call("chmod", "+x", "MakeBoostDistro.py")
-            os.chdir(os.path.dirname(self.root_dir))
-            utils.check_call(
-                pythonbinary,
-                os.path.join(self.build_dir, "MakeBoostDistro.py"),
-                self.root_dir,
-                self.boost_release_name,
-            )
+        def distro_progress(files, total_files, size, total_size):
+            if files == total_files or files % 10000 == 0:
+                utils.log(
+                    "MakeBoostDistro: %d/%d files, %d/%d bytes"
+                    % (files, total_files, size, total_size)
+                )
+
+        os.chdir(self.releases_dir)
+        MakeBoostDistro.main(
+            self.root_dir,
+            self.boost_release_name,
+            jobs=self.jobs,
+            progress=distro_progress,
+        )
 
         # Patch release with the html generate in-place
         for sourcefilename in ["index.html", "libs/libraries.htm"]:
@@ -690,108 +871,136 @@ class script(script_common):
             antora_lib_docs, release_lib_docs, symlinks=False, dirs_exist_ok=True
         )
         packages = []
-        archive_files = []
 
-        # Create packages for LF style content.
-        if self.eol == "LF":
-            os.chdir(self.releases_dir)
-            os.environ["GZIP"] = "-9"
-            os.environ["BZIP2"] = "-9"
-            archive_files.append(
-                "%s%s.tar.gz" % (self.boost_release_name, self.archive_tag)
-            )
-            packages.append(
-                parallel_call(
-                    "tar",
-                    "--exclude=ci_boost_common.py",
-                    "--exclude=ci_boost_release.py",
-                    "-zcf",
-                    "%s%s.tar.gz" % (self.boost_release_name, self.archive_tag),
-                    self.boost_release_name,
-                )
-            )
-            archive_files.append(
-                "%s%s.tar.bz2" % (self.boost_release_name, self.archive_tag)
-            )
-            packages.append(
-                parallel_call(
-                    "tar",
-                    "--exclude=ci_boost_common.py",
-                    "--exclude=ci_boost_release.py",
-                    "-jcf",
-                    "%s%s.tar.bz2" % (self.boost_release_name, self.archive_tag),
-                    self.boost_release_name,
-                )
+        # Nothing in the packages is dated later than the commit, so that
+        # they can be reproduced.
+        created = None
+        created_date = ""
+        try:
+            command = ["git", "-C", self.root_dir, "show", "-s", "--format=%at"]
+            created = int(
+                subprocess.check_output(
+                    command + [self.commit], universal_newlines=True
+                ).strip()
             )
+            created_date = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(created))
+        except:
+            print("Could not find the commit in the git log.")
 
-        # Create packages for CRLF style content.
-        if self.eol == "CRLF":
-            os.chdir(self.releases_dir)
-            archive_files.append(
-                "%s%s.zip" % (self.boost_release_name, self.archive_tag)
-            )
-            packages.append(
-                parallel_call(
-                    "zip",
-                    "-qr",
-                    "-9",
-                    "%s%s.zip" % (self.boost_release_name, self.archive_tag),
-                    self.boost_release_name,
-                    "-x",
-                    self.boost_release_name + "/ci_boost_common.py",
-                    self.boost_release_name + "/ci_boost_release.py",
-                )
-            )
-            archive_files.append(
-                "%s%s.7z" % (self.boost_release_name, self.archive_tag)
-            )
+        # Create the packages, all in one scan of the release tree; see
+        # release_archives.archive_tree.
+        os.chdir(self.releases_dir)
+        release_archives = utils.import_release_tool(
+            "release_archives", self.build_dir, "master", requires=["tree_walk"]
+        )
+        exclude = ["ci_boost_common.py", "ci_boost_release.py"]
+        archive_files = self.package_files()
+        nodocs = self.package_files(docs=False)
+        # The .7z files are made by 7z, which is faster than py7zr but does
+        # its own scans.
+        seven_zips = []
+        if shutil.which("7z"):
+            seven_zips = [f for f in archive_files if f.endswith(".7z")]
+        scanned_files = [f for f in archive_files if f not in seven_zips]
+
+        # Share the CPUs of the container among the packages by how much
+        # work each one is.
+        threads = release_archives.allocate_threads(archive_files)
+        utils.log("Packaging threads: %s" % (threads))
+        metrics = {}
+        with release_archives.Utilization() as utilization:
             with open("/dev/null") as dev_null:
-                utils.check_call(
-                    "7z",
-                    "a",
-                    "-bd",
-                    "-mx=7",
-                    "-mmt2",
-                    "-ms=on",
-                    "-x!" + self.boost_release_name + "/ci_boost_common.py",
-                    "-x!" + self.boost_release_name + "/ci_boost_release.py",
-                    "%s%s.7z" % (self.boost_release_name, self.archive_tag),
-                    self.boost_release_name,
-                    stdout=dev_null,
+                if scanned_files:
+                    packages.append(
+                        parallel_function(
+                            release_archives.archive_tree,
+                            self.boost_release_name,
+                            scanned_files,
+                            threads=threads,
+                            exclude=exclude,
+                            mtime=created,
+                            nodocs=nodocs,
+                            seekable=self.seekable_files(),
+                        )
+                    )
+                for seven_zip in seven_zips:
+                    excluded = exclude
+                    if seven_zip in nodocs:
+                        excluded = exclude + release_archives.doc_folders
+                    packages.append(
+                        parallel_call(
+                            "7z",
+                            "a",
+                            "-bd",
+                            "-mx=7",
+                            "-mmt=%d" % (threads[seven_zip]),
+                            "-ms=on",
+                            *[
+                                "-x!%s/%s" % (self.boost_release_name, path)
+                                for path in excluded
+                            ],
+                            seven_zip,
+                            self.boost_release_name,
+                            stdout=dev_null,
+                        )
+                    )
+                for package in packages:
+                    package.join()
+                if scanned_files:
+                    metrics = packages[0].result
+        utils.log("Packaging took %s" % (utilization))
+        for seven_zip in seven_zips:
+            wall_time = [
+                t for t, d, c, r in utils.call_stats if c[0] == "7z" and seven_zip in c
+            ][-1]
+            metrics[seven_zip] = {
+                "size": os.path.getsize(seven_zip),
+                "wall_seconds": round(wall_time, 3),
+                "threads": threads[seven_zip],
+                "encoder": "7z -mx=7 -ms=on",
+            }
+            # 7z read the same tree as the other package of its variant
+            scanned = [
+                metrics[f]
+                for f in scanned_files
+                if (f in nodocs) == (seven_zip in nodocs)
+            ]
+            if scanned:
+                size = metrics[seven_zip]["size"]
+                metrics[seven_zip]["uncompressed_size"] = scanned[0][
+                    "uncompressed_size"
+                ]
+                metrics[seven_zip]["entries"] = scanned[0]["entries"]
+                metrics[seven_zip]["compression_ratio"] = round(
+                    float(scanned[0]["uncompressed_size"]) / size, 3
                 )
-
-        for package in packages:
-            package.join()
+        # The tar files were hashed while written
+        sha256_sums = release_archives.sha256_files(
+            archive_files,
+            dict((f, m.get("sha256")) for f, m in metrics.items()),
+        )
 
         # Create archive info data files.
         for archive_file in archive_files:
-            sha256_sum = hashlib.sha256(open(archive_file, "rb").read()).hexdigest()
-            created_date = ""
-            try:
-                created_date = subprocess.check_output(
-                    "set -e && set -o pipefail; TZ=UTC git -C "
-                    + self.root_dir
-                    + " show -s --date='format-local:%Y-%m-%dT%H:%M:%SZ' "
-                    + self.commit
-                    + " | grep Date: | tr -s ' ' | cut -d' ' -f 2 ",
-                    universal_newlines=True,
-                    shell=True,
-                    executable="/bin/bash",
-                )
-                created_date = created_date.strip()
-            except:
-                print("Could not find the commit in the git log.")
-
-            utils.make_file(
-                "%s.json" % (archive_file),
-                "{",
-                '"sha256":"%s",' % (sha256_sum),
-                '"file":"%s",' % (archive_file),
-                '"branch":"%s",' % (self.branch),
-                '"commit":"%s",' % (self.commit),
-                '"created":"%s"' % (created_date),
-                "}",
-            )
+            info = {
+                "sha256": sha256_sums[archive_file],
+                "file": archive_file,
+                "branch": self.branch,
+                "commit": self.commit,
+                "created": created_date,
+                "fingerprint": self.snapshot_fingerprint(),
+                "metrics": dict(
+                    (k, v) for k, v in metrics[archive_file].items() if k != "sha256"
+                ),
+            }
+            with open("%s.json" % (archive_file), "w") as f:
+                json.dump(info, f, indent=4)
+                f.write("\n")
+
+        # Create the index files of the seekable packages.
+        for archive_file in self.seekable_files():
+            with open("%s.index.json" % (archive_file), "w") as f:
+                json.dump(release_archives.archive_index(archive_file), f)
 
         # List the results for debugging.
         utils.check_call("ls", "-la")
@@ -1073,21 +1282,20 @@ region = us-east-2
         if self.mode == "check":
             return
 
-        if self.eol == "LF":
-            os.chdir(os.path.dirname(self.root_dir))
-            self.upload_archives(
-                "%s%s.tar.gz" % (self.boost_release_name, self.archive_tag),
-                "%s%s.tar.gz.json" % (self.boost_release_name, self.archive_tag),
-                "%s%s.tar.bz2" % (self.boost_release_name, self.archive_tag),
-                "%s%s.tar.bz2.json" % (self.boost_release_name, self.archive_tag),
-            )
-        if self.eol == "CRLF":
+        if self.snapshot_unchanged():
+            utils.log("ci_boost_release: snapshot unchanged, not uploading")
+            return
+
+        archive_files = self.package_files()
+        if archive_files:
             os.chdir(os.path.dirname(self.root_dir))
             self.upload_archives(
-                "%s%s.zip" % (self.boost_release_name, self.archive_tag),
-                "%s%s.zip.json" % (self.boost_release_name, self.archive_tag),
-                "%s%s.7z" % (self.boost_release_name, self.archive_tag),
-                "%s%s.7z.json" % (self.boost_release_name, self.archive_tag),
+                *[
+                    f
+                    for archive_file in archive_files
+                    for f in (archive_file, archive_file + ".json")
+                ]
+                + [f + ".index.json" for f in self.seekable_files()]
             )
 
         self.website_upload_to_s3()
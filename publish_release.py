@@ -40,6 +40,10 @@ from pathlib import Path
 import subprocess
 import pathlib
 import time
+import mmap
+import threading
+import concurrent.futures
+import release_archives
 
 # run: pip3 install python-dotenv
 from dotenv import load_dotenv
@@ -58,15 +62,72 @@ boost_websites = ["https://www.boost.org", "https://www.stage.boost.org"]
 # defaults, used later
 stagingPath2 = ""
 checksum_succeeded = True
+# The session the downloads share, set up once the options are known
+downloadSession = requests.Session()
+# The sha256 of the files fileHash hashed, by path, with the size, mtime
+# and inode they had then, kept from one run to the next
+hashCacheFile = str(Path.home()) + "/.cache/boost_publish_release_hashes.json"
+hashCache = None
+hashCacheLock = threading.Lock()
+
+
+def fileStamp(fileName):
+    st = os.stat(fileName)
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+
+def loadHashCache():
+    # 	Called with hashCacheLock held
+    global hashCache
+    if hashCache is None:
+        try:
+            with open(hashCacheFile, "r") as f:
+                hashCache = json.load(f)
+        except (OSError, ValueError):
+            hashCache = {}
+
+
+def cachedHash(fileName):
+    with hashCacheLock:
+        loadHashCache()
+        cached = hashCache.get(os.path.abspath(fileName))
+        if cached and cached[:3] == fileStamp(fileName):
+            return cached[3]
+    return None
+
+
+def cacheHash(fileName, digest):
+    with hashCacheLock:
+        loadHashCache()
+        hashCache[os.path.abspath(fileName)] = fileStamp(fileName) + [digest]
+        # 	Forget the files that are gone
+        for path in [p for p in hashCache if not os.path.exists(p)]:
+            del hashCache[path]
+        os.makedirs(os.path.dirname(hashCacheFile), exist_ok=True)
+        with open(hashCacheFile + ".tmp", "w") as f:
+            json.dump(hashCache, f)
+        os.replace(hashCacheFile + ".tmp", hashCacheFile)
 
 
 def fileHash(fileName):
+    digest = cachedHash(fileName)
+    if digest is not None:
+        return digest
     sha256_hash = hashlib.sha256()
     with open(fileName, "rb") as f:
-        # Read and update hash string value in blocks of 4K
-        for byte_block in iter(lambda: f.read(4096), b""):
-            sha256_hash.update(byte_block)
-    return sha256_hash.hexdigest()
+        if os.fstat(f.fileno()).st_size:
+            # 	Hash the whole mapped file in one call, which releases the GIL
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                sha256_hash.update(m)
+    digest = sha256_hash.hexdigest()
+    cacheHash(fileName, digest)
+    return digest
+
+
+def fileHashes(fileNames):
+    # 	{fileName: sha256} of fileNames, hashed in parallel
+    with concurrent.futures.ThreadPoolExecutor(os.cpu_count() or 1) as pool:
+        return dict(zip(fileNames, pool.map(fileHash, fileNames)))
 
 
 def genJSON(snapshotJSON, fileName, incomingSHA, nodocs=False):
@@ -89,13 +150,94 @@ def genJSON(snapshotJSON, fileName, incomingSHA, nodocs=False):
 
 
 # Copied from https://stackoverflow.com/questions/16694907/download-large-file-in-python-with-requests
-def downloadAFile(url, destFile):
-    if os.path.exists(destFile) and options.skip_redownloading:
-        print(f"{destFile} already present. Skipping the download.")
-    else:
-        with requests.get(url, stream=True) as r:
-            with open(destFile, "wb") as f:
-                shutil.copyfileobj(r.raw, f)
+def downloadAFile(url, destFile, sha256=None, size=None):
+    # 	Returns the number of bytes downloaded. The file is hashed as it
+    # 	arrives, and its sha256 cached for fileHash. Given the sha256 and
+    # 	size the file should have, a destFile that has them is kept, one
+    # 	left partial by an interrupted run is resumed with a Range request,
+    # 	and a download that can not match them is stopped early.
+    sha256_hash = hashlib.sha256()
+    start = 0
+    if sha256 is not None and os.path.exists(destFile):
+        if cachedHash(destFile) == sha256:
+            print(f"{destFile} already present, with the right checksum.")
+            return 0
+        # 	Hash what is there, to go on from it
+        with open(destFile, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                sha256_hash.update(block)
+            start = f.tell()
+        if sha256_hash.hexdigest() == sha256:
+            cacheHash(destFile, sha256)
+            print(f"{destFile} already present, with the right checksum.")
+            return 0
+        if size is not None and start >= size:
+            start = 0
+            sha256_hash = hashlib.sha256()
+    headers = {"Range": "bytes=%d-" % start} if start else {}
+    with downloadSession.get(url, stream=True, headers=headers) as r:
+        if r.status_code == 416:
+            # 	destFile is no shorter than the file, but is wrong
+            os.remove(destFile)
+            return downloadAFile(url, destFile, sha256, size)
+        r.raise_for_status()
+        if r.status_code != 206:
+            start = 0
+            sha256_hash = hashlib.sha256()
+        else:
+            print(f"Resuming {destFile} from byte {start}")
+        length = r.headers.get("Content-Length")
+        if size is not None and length is not None and start + int(length) != size:
+            raise RuntimeError(
+                "%s is %d bytes, not %d" % (url, start + int(length), size)
+            )
+        received = 0
+        with open(destFile, "ab" if start else "wb") as f:
+            for block in iter(lambda: r.raw.read(1024 * 1024), b""):
+                received += len(block)
+                if size is not None and start + received > size:
+                    raise RuntimeError("%s is longer than %d bytes" % (url, size))
+                sha256_hash.update(block)
+                f.write(block)
+    digest = sha256_hash.hexdigest()
+    cacheHash(destFile, digest)
+    if sha256 is not None and digest != sha256:
+        if start:
+            # 	What was there before was not the start of the file
+            print(f"{destFile} was corrupt, downloading it again")
+            os.remove(destFile)
+            return downloadAFile(url, destFile, sha256, size)
+        raise RuntimeError(
+            "Checksum failure for %s: %s instead of %s" % (destFile, digest, sha256)
+        )
+    return received
+
+
+def downloadFiles(downloads):
+    # 	Download the (url, destFile) or (url, destFile, sha256, size) tuples
+    # 	in downloads, options.download_jobs at a time over downloadSession,
+    # 	and report the throughput of each.
+    def download(arguments):
+        url, destFile = arguments[:2]
+        print("Downloading: %s to %s" % (url, destFile))
+        start = time.time()
+        size = downloadAFile(*arguments)
+        return destFile, size, time.time() - start
+
+    start = time.time()
+    with concurrent.futures.ThreadPoolExecutor(options.download_jobs) as pool:
+        results = list(pool.map(download, downloads))
+    elapsed = time.time() - start
+    for destFile, size, seconds in results:
+        print(
+            "Downloaded %s: %.1f MB in %.1fs, %.1f MB/s"
+            % (destFile, size / 1e6, seconds, size / 1e6 / max(seconds, 1e-3))
+        )
+    total = sum(size for destFile, size, seconds in results)
+    print(
+        "Downloaded %d files: %.1f MB in %.1fs, %.1f MB/s"
+        % (len(results), total / 1e6, elapsed, total / 1e6 / max(elapsed, 1e-3))
+    )
 
 
 def downloadJFROGFiles(sourceRepo, sourceFileName, destFileName, suffix):
@@ -112,18 +254,32 @@ def downloadJFROGFiles(sourceRepo, sourceFileName, destFileName, suffix):
     downloadAFile(jfrogURL + sourceRepo + jsonFile, jsonFile)
 
 
-def downloadFASTLYFiles(sourceFileName, destFileName, suffix):
-    #   Download two files here:
+def listFASTLYFiles(sourceFileName, destFileName, suffix):
+    #   The (url, destFile) pairs of the two files to download:
     #           boost_X_YY_ZZ-snapshot.Q      -> boost_X_YY_ZZ.Q
     #           boost_X_YY_ZZ-snapshot.Q.json -> boost_X_YY_ZZ-snapshot.Q.json
 
     sourceFile = "%s%s" % (sourceFileName, suffix)
     destFile = "%s%s" % (destFileName, suffix)
     jsonFile = "%s.json" % sourceFile
-    print("Downloading: %s to %s" % (sourceFile, destFile))
-    downloadAFile(fastlyURL + "master/" + sourceFile, destFile)
-    print("Downloading: %s to %s" % (jsonFile, jsonFile))
-    downloadAFile(fastlyURL + "master/" + jsonFile, jsonFile)
+    return [
+        (fastlyURL + "master/" + sourceFile, destFile),
+        (fastlyURL + "master/" + jsonFile, jsonFile),
+    ]
+
+
+def downloadFASTLYFiles(sourceFileName, destFileName, suffixes):
+    # 	Download the files of listFASTLYFiles for each suffix, the .json
+    # 	files first, for the sha256 and size that the archives should have.
+    files = [listFASTLYFiles(sourceFileName, destFileName, s) for s in suffixes]
+    downloadFiles([jsonFile for archive, jsonFile in files])
+    downloads = []
+    for archive, jsonFile in files:
+        with open(jsonFile[1], "r") as f:
+            snap = json.load(f)
+        size = snap.get("metrics", {}).get("size")
+        downloads.append(archive + (snap["sha256"], size))
+    downloadFiles(downloads)
 
 
 def copyJFROGFile(sourceRepo, sourceFileName, destRepo, destFileName, suffix):
@@ -531,11 +687,20 @@ parser.add_option(
     dest="skip_nodocs",
 )
 
+parser.add_option(
+    "--download-jobs",
+    default=4,
+    type="int",
+    help="number of files downloaded at once (default 4)",
+    dest="download_jobs",
+)
+
 parser.add_option(
     "--skip-redownloading",
     default=False,
     action="store_true",
-    help="skip redownloading archives during tests",
+    help="no longer needed: archives already downloaded are kept when their "
+    "checksum matches, and partial ones are resumed",
     dest="skip_redownloading",
 )
 
@@ -566,6 +731,11 @@ if len(args) != 1:
 
 preflight()
 
+# Keep a connection open for each download running at once
+downloadSession.mount(
+    "https://", requests.adapters.HTTPAdapter(pool_maxsize=options.download_jobs)
+)
+
 boostVersion = args[0]
 dottedVersion = boostVersion.replace("_", ".")
 sourceRepo = "main/master/"
@@ -615,22 +785,29 @@ if options.progress:
 
 suffixes = [".7z", ".zip", ".tar.bz2", ".tar.gz"]
 snapshotName = "boost_%s-snapshot" % boostVersion
+# The CI only makes a .tar.zst where zstd is installed, publish it if the
+# snapshot has one
+if downloadSession.head(fastlyURL + "master/" + snapshotName + ".tar.zst").ok:
+    suffixes.append(".tar.zst")
+elif options.progress:
+    print("%s.tar.zst not found, skipping it" % snapshotName)
 
 # Download the files
 if options.progress:
     print("Downloading from: %s" % sourceRepo)
-for s in suffixes:
-    # downloadJFROGFiles(sourceRepo, snapshotName, actualName, s)
-    downloadFASTLYFiles(snapshotName, actualName, s)
+# for s in suffixes:
+#     downloadJFROGFiles(sourceRepo, snapshotName, actualName, s)
+downloadFASTLYFiles(snapshotName, actualName, suffixes)
 
 # Create the JSON files
+hashes = fileHashes([actualName + s for s in suffixes])
 for s in suffixes:
     sourceFileName = actualName + s
     jsonFileName = sourceFileName + ".json"
     jsonSnapshotName = snapshotName + s + ".json"
     if options.progress:
         print("Writing JSON to: %s" % jsonFileName)
-    jsonData = genJSON(jsonSnapshotName, sourceFileName, fileHash(sourceFileName))
+    jsonData = genJSON(jsonSnapshotName, sourceFileName, hashes[sourceFileName])
     with open(jsonFileName, "w", encoding="utf-8") as f:
         json.dump(jsonData, f, ensure_ascii=False, indent=0)
 
@@ -655,60 +832,66 @@ if os.path.isdir(hostedArchiveName):
 shutil.move(archiveDirTmp + "/" + unzippedArchiveName, hostedArchiveName)
 os.chdir(origDir)
 
-# Generate nodocs versions
+# Get the nodocs versions. Snapshots come with -nodocs archives, made in
+# the same pass as the others; for an older snapshot, they are generated
+# from its archives.
 if not options.skip_nodocs:
     print("Processing nodocs")
     origDir = os.getcwd()
-    # [".7z", ".zip", ".tar.bz2", ".tar.gz"]
-    unzip_method = {}
-    unzip_method[".7z"] = "7z x"
-    unzip_method[".zip"] = "unzip"
-    unzip_method[".tar.bz2"] = "tar -xvf"
-    unzip_method[".tar.gz"] = "tar -xvf"
-    zip_method = {}
-    zip_method[".7z"] = "7z a -bd -mx=7 -mmt2 -ms=on"
-    zip_method[".zip"] = "zip -qr -9"
-    zip_method[".tar.bz2"] = "tar -jcf"
-    zip_method[".tar.gz"] = "tar -zcf"
-
+    nodocsDir = str(Path.home()) + "/archives-nodocs"
+    nodocsSnapshotName = snapshotName + "-nodocs"
+    Path(nodocsDir).mkdir(parents=True, exist_ok=True)
+    nodocsSuffixes = [
+        s
+        for s in suffixes
+        if downloadSession.head(fastlyURL + "master/" + nodocsSnapshotName + s).ok
+    ]
+    downloadFASTLYFiles(
+        nodocsSnapshotName, nodocsDir + "/" + actualName, nodocsSuffixes
+    )
     for s in suffixes:
         os.chdir(origDir)
         archiveName = actualName + s
-        archiveDirTmp = str(Path.home()) + f"/archives-nodocs/{s}"
-        if os.path.isdir(archiveDirTmp):
-            shutil.rmtree(archiveDirTmp)
-        Path(archiveDirTmp).mkdir(parents=True, exist_ok=True)
-        shutil.copyfile(archiveName, archiveDirTmp + "/" + archiveName)
-        os.chdir(archiveDirTmp)
-        extraction_command = unzip_method[s]
-        print(f"Extracting {archiveName}")
-        os.system(f"{extraction_command} {archiveName}")
-        os.chdir(f"boost_{boostVersion}")
-        print(f"Removing doc/ directories")
-        os.system("rm -rf libs/*/doc libs/numeric/*/doc tools/*/doc doc/")
-        os.chdir("../")
-        if os.path.exists("../" + archiveName):
-            print(f"Removing {archiveName}")
-            os.remove("../" + archiveName)
-        compression_method = zip_method[s]
-        print(f"Compressing {archiveName}")
-        os.system(f"{compression_method} ../{archiveName} boost_{boostVersion}")
-        os.chdir("../")
+        if s in nodocsSuffixes:
+            jsonSnapshotName = origDir + "/" + nodocsSnapshotName + s + ".json"
+            generated = False
+        else:
+            print(f"{nodocsSnapshotName}{s} not found, filtering {archiveName}")
+            nodocsArchiveName = nodocsDir + "/" + archiveName
+            if s == ".7z":
+                # 7z can't be read as a stream, delete the doc folders in a copy
+                shutil.copyfile(archiveName, nodocsArchiveName)
+                subprocess.run(
+                    ["7z", "d", "-bd", nodocsArchiveName]
+                    + [
+                        f"boost_{boostVersion}/{d}"
+                        for d in release_archives.doc_folders
+                    ],
+                    check=True,
+                )
+            else:
+                # Copy the archive member by member, without the doc folders
+                release_archives.filter_archive(archiveName, nodocsArchiveName)
+            jsonSnapshotName = origDir + "/" + snapshotName + s + ".json"
+            generated = True
+        os.chdir(nodocsDir)
 
         # Create the JSON files
         sourceFileName = actualName + s
         jsonFileName = sourceFileName + ".json"
-        jsonSnapshotName = origDir + "/" + snapshotName + s + ".json"
         if options.progress:
             print("Writing JSON to: %s" % jsonFileName)
         jsonData = genJSON(
-            jsonSnapshotName, sourceFileName, fileHash(sourceFileName), nodocs=True
+            jsonSnapshotName, sourceFileName, fileHash(sourceFileName), nodocs=generated
         )
         with open(jsonFileName, "w", encoding="utf-8") as f:
             json.dump(jsonData, f, ensure_ascii=False, indent=0)
 
         os.chdir(origDir)
 
+if not checksum_succeeded:
+    exit(1)
+
 
 # Upload the files to JFROG
 if options.progress:
@@ -0,0 +1,1372 @@
+#!/usr/bin/env python
+#
+# Distributed under the Boost Software License, Version 1.0.
+# (See accompanying file LICENSE_1_0.txt or copy at
+# http://www.boost.org/LICENSE_1_0.txt)
+#
+# Archive writers for the release packages.
+#
+# Each writer takes entries one at a time, as (archive name, source path)
+# pairs, so a release archive can be produced straight from a list of
+# files, such as a MakeBoostDistro manifest, without first laying the
+# release tree out on disk.
+#
+# A writer opened with eol="crlf" converts the line endings of text files
+# on the fly, the way a checkout with core.autocrlf=true would, so the
+# Windows archives can be made from the same LF tree as the tar files.
+#
+# Compressed tar files are written with pigz, lbzip2 or pbzip2, when
+# installed, or else by a ParallelCompressor, when more than one thread is
+# given: the tar stream is cut into blocks that a pool of threads
+# compresses at once, into gzip members or bzip2 streams that standard
+# decoders read back as a single file. .tar.zst files are always written
+# with zstd, using its own threads, or else with the zstandard module.
+#
+# archive_tree writes a whole tree to several archives in one scan: every
+# file is read once and its content handed to all the writers, each
+# running in a thread of its own. The nodocs ones among them are not
+# handed what is in the doc_folders.
+#
+# Tar files are hashed as they are written, so their SHA-256 is known as
+# soon as they are closed; sha256_files hashes the other archives, which
+# zipfile and py7zr seek back into, in parallel.
+#
+# filter_archive writes a copy of an archive without some of its
+# entries, such as the nodocs packages of an archive with the docs,
+# reading it entry by entry. Zip entries are copied without recompressing.
+#
+# archive_index lists where each file is in a .zip, .tar, or seekable
+# .tar.gz file, for a server to get single files out of the archive with
+# HTTP range requests.
+#
+# Every writer counts what it stores and times itself, and archive_tree
+# returns those metrics, which end up in the .json file of each package.
+#
+# Given a time, mtime or $SOURCE_DATE_EPOCH, the tar and zip files are
+# reproducible: their entries come in a fixed order, owned by root, with
+# 644 or 755 modes and no mtime later than that time, which the release
+# scripts set to the date of the commit. Their compressed tar files do
+# not depend on the threads or tools of the builder: .tar.gz and .tar.bz2
+# files are always written by a ParallelCompressor, in blocks of the same
+# size, whose gzip members store no time or name, and .tar.zst files by
+# zstd in its multi-threaded mode, which gives the same output with any
+# number of threads, for a given zstd version.
+#
+# allocate_threads shares the CPUs among the archives written at the same
+# time, by how much work each format takes, within the CPU and memory
+# limits of the cgroup, and Utilization reports how busy they were kept.
+
+from __future__ import print_function
+
+import io
+import os
+import bz2
+import gzip
+import stat
+import time
+import zlib
+import bisect
+import struct
+import shutil
+import hashlib
+import tarfile
+import zipfile
+import fnmatch
+import threading
+import subprocess
+import collections
+from multiprocessing.pool import ThreadPool
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    import py7zr
+except ImportError:
+    py7zr = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+import tree_walk
+
+
+class EolConverter(object):
+    """
+    LF to CRLF conversion of text files with git's core.autocrlf=true
+    rules (convert.c): a file is converted only if it has bare LFs, no CR
+    at all and does not look binary, i.e. has no NUL and less than one
+    non printable character per 128 printable ones. .gitattributes
+    overrides are not taken into account.
+    """
+
+    # Not even read for the content check.
+    binary_extensions = set(
+        """
+        .7z .a .bmp .bz2 .dll .eot .exe .gif .gz .ico .jar .jpeg .jpg .lib
+        .o .obj .otf .pdf .png .pyc .so .svgz .tar .tgz .ttf .webp .woff
+        .woff2 .xz .zip .zst
+        """.split()
+    )
+
+    # Control characters git counts as non printable; NUL is one of them.
+    nonprintable = bytes(
+        bytearray(c for c in range(32) if c not in b"\b\t\033\014\r\n") + b"\x7f"
+    )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last = (None, None)
+
+    @classmethod
+    def is_text(cls, data):
+        crlf = data.count(b"\r\n")
+        cr = data.count(b"\r")
+        lf = data.count(b"\n")
+        if lf == crlf:
+            # No bare LF, nothing to convert
+            return False
+        if cr:
+            # Bare CRs, or CRLFs already: git leaves the file alone
+            return False
+        if b"\0" in data:
+            return False
+        nonprintable = len(data) - len(data.translate(None, cls.nonprintable))
+        printable = len(data) - nonprintable - lf
+        if data.endswith(b"\032"):
+            # A DOS end of file marker does not count
+            nonprintable -= 1
+        return (printable >> 7) >= nonprintable
+
+    def convert(self, path, data=None):
+        """
+        The CRLF content of the file at path, or None when the file is
+        to be archived as it is. data is the content of the file, if it
+        was read already. The last result is kept, so that writers of
+        several archives fed the same file only convert it once.
+        """
+        with self.lock:
+            if self.last[0] == path:
+                return self.last[1]
+        if os.path.splitext(path)[1].lower() in self.binary_extensions:
+            result = None
+        else:
+            if data is None:
+                with open(path, "rb") as f:
+                    data = f.read()
+            if self.is_text(data):
+                result = data.replace(b"\n", b"\r\n")
+            else:
+                result = None
+        with self.lock:
+            self.last = (path, result)
+        return result
+
+
+crlf_converter = EolConverter()
+
+
+# Multi-threaded compressors to use, when installed, in order of
+# preference. Their output is read by any gzip, bzip2 or zstd decoder.
+compress_programs = {
+    "gz": [["pigz", "-{level}", "-n", "-p", "{threads}"]],
+    "bz2": [
+        ["lbzip2", "-{level}", "-n", "{threads}"],
+        ["pbzip2", "-{level}", "-p{threads}"],
+    ],
+    "zst": [["zstd", "-q", "-{level}", "-T{threads}"]],
+}
+
+# The compression levels of the release packages
+compress_levels = {"gz": 9, "bz2": 9, "zst": 19}
+
+
+def compress_program(compression, threads, level=None):
+    """
+    The command line of an installed multi-threaded compressor for
+    compression, "gz", "bz2" or "zst", or None if there is none.
+    """
+    if level is None:
+        level = compress_levels[compression]
+    for command in compress_programs[compression]:
+        if shutil.which(command[0]):
+            return [a.format(level=level, threads=threads) for a in command]
+    return None
+
+
+class ParallelCompressor(object):
+    """
+    A write only file object, gzip or bzip2 compressing what is written to
+    it into fileobj with a pool of threads. The data is cut into blocks,
+    each compressed into a gzip member or a bzip2 stream of its own, which
+    decoders read back as one file, as they do the output of pbzip2. The
+    blocks are large enough for the archives to be within a percent or
+    two of the size gzip -9 and bzip2 -9 give, unless a smaller
+    block_size is given.
+    """
+
+    # A bzip2 block holds 900000 bytes after run length encoding, which
+    # is more than 900000 bytes of a tar file with its runs of NULs, so a
+    # bzip2 stream per 900000 bytes would waste most of its last block.
+    block_sizes = {"gz": 4 << 20, "bz2": 9 * 900000}
+
+    def __init__(self, fileobj, compression, level=9, threads=None, block_size=None):
+        self.fileobj = fileobj
+        self.compression = compression
+        self.level = level
+        self.threads = threads or os.cpu_count() or 1
+        self.block_size = block_size or self.block_sizes[compression]
+        self.pool = ThreadPool(self.threads)
+        self.pending = collections.deque()
+        self.buffer = bytearray()
+        self.blocks = 0
+        # The CPU time of each block, taken by the thread compressing it
+        self.cpu_times = []
+
+    @property
+    def cpu_time(self):
+        return sum(self.cpu_times)
+
+    def compress(self, data):
+        # zlib and bz2 release the GIL, so the pool threads run in parallel
+        started = time.thread_time()
+        if self.compression == "gz":
+            # A gzip member, with no name and a zero mtime
+            c = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+            data = c.compress(data) + c.flush()
+        else:
+            data = bz2.compress(data, self.level)
+        self.cpu_times.append(time.thread_time() - started)
+        return data
+
+    def submit(self, data):
+        self.pending.append(self.pool.apply_async(self.compress, (data,)))
+        self.blocks += 1
+        # Bound the memory used by the blocks in flight
+        while len(self.pending) > 2 * self.threads:
+            self.fileobj.write(self.pending.popleft().get())
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self.submit(bytes(self.buffer[: self.block_size]))
+            del self.buffer[: self.block_size]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """Write the last block and wait for all of them; fileobj stays open."""
+        if self.pool is None:
+            return
+        if self.buffer or not self.blocks:
+            self.submit(bytes(self.buffer))
+            self.buffer = bytearray()
+        while self.pending:
+            self.fileobj.write(self.pending.popleft().get())
+        self.pool.close()
+        self.pool.join()
+        self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class HashingFile(object):
+    """
+    A write only file object that passes what is written to it on to
+    fileobj, hashing it on the way. Only for files written from start to
+    end, without seeking back.
+    """
+
+    def __init__(self, fileobj, algorithm="sha256"):
+        self.fileobj = fileobj
+        self.name = getattr(fileobj, "name", None)
+        self.hash = hashlib.new(algorithm)
+        self.size = 0
+
+    def write(self, data):
+        # hashlib releases the GIL for large writes
+        self.hash.update(data)
+        self.size += len(data)
+        return self.fileobj.write(data)
+
+    def tell(self):
+        return self.size
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def close(self):
+        self.fileobj.close()
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+
+def file_sha256(filename, block_size=1 << 20):
+    """The SHA-256 of the file filename, read block by block."""
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def sha256_files(filenames, known={}, threads=None):
+    """
+    {filename: SHA-256} of all of filenames, taking those in known as
+    they are and hashing the others in parallel.
+    """
+    missing = [f for f in filenames if not known.get(f)]
+    pool = ThreadPool(max(1, min(len(missing), threads or os.cpu_count() or 1)))
+    try:
+        sums = dict(zip(missing, pool.map(file_sha256, missing)))
+    finally:
+        pool.close()
+    for f in filenames:
+        if known.get(f):
+            sums[f] = known[f]
+    return sums
+
+
+class ArchiveWriter(object):
+    """
+    Base class of the writers. Names are relative, "/" separated paths
+    inside the archive; folders must be added before their content.
+
+    After close, sha256 is the SHA-256 of the archive if the writer
+    hashed it while writing it, or else None, and metrics describes how
+    it was made.
+
+    With an mtime, the archive is reproducible: see normalize.
+    """
+
+    # How the content is compressed, with which settings
+    encoder = None
+
+    def __init__(self, filename, eol=None, threads=1, mtime=None):
+        self.filename = filename
+        self.eol = eol
+        self.threads = threads
+        self.mtime = mtime
+        self.sha256 = None
+        self.entries = 0
+        self.uncompressed_size = 0
+        # The CPU time of the compressor threads and processes. A FanOut
+        # adds that of the thread it runs the writer in.
+        self.cpu_time = 0.0
+        self.started = time.time()
+        self.wall_time = None
+
+    def count(self, size=0):
+        """Count an entry of size bytes in the archive."""
+        self.entries += 1
+        self.uncompressed_size += size
+
+    def finish(self):
+        """Write the end of the archive and close it."""
+        raise NotImplementedError
+
+    def close(self):
+        self.finish()
+        self.wall_time = time.time() - self.started
+
+    def metrics(self):
+        """
+        The figures of the closed archive, for its .json file: its size,
+        the size and number of the entries in it, the compression ratio,
+        the wall and CPU seconds it took, and the encoder settings.
+        """
+        size = os.path.getsize(self.filename)
+        return {
+            "sha256": self.sha256,
+            "size": size,
+            "uncompressed_size": self.uncompressed_size,
+            "entries": self.entries,
+            "compression_ratio": (
+                round(float(self.uncompressed_size) / size, 3) if size else None
+            ),
+            "wall_seconds": round(self.wall_time, 3),
+            "cpu_seconds": round(self.cpu_time, 3),
+            "threads": self.threads,
+            "encoder": self.encoder,
+        }
+
+    def normalize(self, mode, mtime):
+        """
+        The (mode, mtime) to archive for a file with those: as they are,
+        or for a reproducible archive, 755 for folders and executables,
+        644 for the rest, and mtime no later than self.mtime.
+        """
+        if self.mtime is None:
+            return mode, mtime
+        if stat.S_ISDIR(mode) or mode & 0o111:
+            permissions = 0o755
+        else:
+            permissions = 0o644
+        return stat.S_IFMT(mode) | permissions, min(mtime, self.mtime)
+
+    def content(self, path, data=None):
+        """
+        What to archive for the file at path, whose content is data if it
+        was read already: the converted content, data, or None to archive
+        the file as it is.
+        """
+        if self.eol == "crlf":
+            converted = crlf_converter.convert(path, data)
+            if converted is not None:
+                return converted
+        return data
+
+    def add_dir(self, name, path=None):
+        """Add a folder. Its mode and mtime come from path, if given."""
+        raise NotImplementedError
+
+    def add_file(self, name, path, data=None):
+        """
+        Add the file at path, following symlinks. data is its content, if
+        it was read already.
+        """
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TarWriter(ArchiveWriter):
+    # Suffix -> tarfile mode
+    modes = {
+        ".tar": "w",
+        ".tar.gz": "w:gz",
+        ".tgz": "w:gz",
+        ".tar.bz2": "w:bz2",
+        ".tar.zst": "w:zst",
+    }
+
+    def __init__(
+        self, filename, suffix, eol=None, threads=1, mtime=None, seekable=False
+    ):
+        super(TarWriter, self).__init__(filename, eol, threads, mtime)
+        mode = self.modes[suffix]
+        block_size = None
+        if seekable and mode == "w:gz":
+            block_size = seekable_block_size
+        elif seekable and mode != "w":
+            raise ValueError("%s can not be made seekable" % filename)
+        elif mtime is not None and mode in ("w:gz", "w:bz2"):
+            # A reproducible archive must not depend on the threads or the
+            # tools of the builder: always the same blocks, by the same
+            # encoder
+            block_size = ParallelCompressor.block_sizes[mode[2:]]
+        self.file = HashingFile(open(filename, "wb"))
+        self.compressor = None
+        self.process = None
+        program = None
+        if mode != "w" and not block_size and (threads > 1 or mode == "w:zst"):
+            program = compress_program(mode[2:], threads)
+        if mode == "w":
+            self.encoder = "tar"
+            self.tar = tarfile.open(
+                fileobj=self.file, mode=mode, format=tarfile.GNU_FORMAT
+            )
+        elif program:
+            self.encoder = " ".join(program)
+            self.process = subprocess.Popen(
+                program, stdin=subprocess.PIPE, stdout=subprocess.PIPE
+            )
+            self.copier = threading.Thread(
+                target=shutil.copyfileobj,
+                args=(self.process.stdout, self.file, 1 << 20),
+            )
+            self.copier.start()
+            self.tar = tarfile.open(
+                fileobj=self.process.stdin, mode="w|", format=tarfile.GNU_FORMAT
+            )
+        elif mode == "w:zst":
+            if zstandard is None:
+                raise ValueError(
+                    "Writing %s needs zstd or the zstandard module" % filename
+                )
+            level = compress_levels["zst"]
+            self.encoder = "zstandard level %d" % level
+            # zstd's multi-threaded mode, as that of the zstd command, writes
+            # the same frames whatever the number of threads, which its
+            # single-threaded mode, threads=0, does not
+            if threads > 1 or mtime is not None:
+                workers = threads
+            else:
+                workers = 0
+            self.compressor = zstandard.ZstdCompressor(
+                level=level, threads=workers
+            ).stream_writer(self.file, closefd=False)
+            self.tar = tarfile.open(
+                fileobj=self.compressor, mode="w|", format=tarfile.GNU_FORMAT
+            )
+        elif threads > 1 or block_size:
+            block_size = block_size or ParallelCompressor.block_sizes[mode[2:]]
+            self.encoder = "%s level 9 in %d byte blocks" % (mode[2:], block_size)
+            self.compressor = ParallelCompressor(
+                self.file, mode[2:], 9, threads, block_size
+            )
+            self.tar = tarfile.open(
+                fileobj=self.compressor, mode="w|", format=tarfile.GNU_FORMAT
+            )
+        else:
+            # The same level as GZIP=-9 and BZIP2=-9
+            self.encoder = "%s level 9" % mode[2:]
+            if mode == "w:gz":
+                self.compressor = gzip.GzipFile(
+                    filename, "wb", 9, self.file, mtime=mtime
+                )
+            else:
+                self.compressor = bz2.BZ2File(self.file, "wb", compresslevel=9)
+            self.tar = tarfile.open(
+                fileobj=self.compressor, mode="w", format=tarfile.GNU_FORMAT
+            )
+
+    def addfile(self, info, fileobj=None):
+        if self.mtime is not None:
+            info.uid = info.gid = 0
+            info.uname = info.gname = "root"
+        info.mode, info.mtime = self.normalize(info.mode, info.mtime)
+        self.tar.addfile(info, fileobj)
+        self.count(info.size)
+
+    def add_dir(self, name, path=None):
+        if path is None:
+            info = tarfile.TarInfo(name)
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+            info.mtime = int(time.time())
+        else:
+            info = self.tar.gettarinfo(path, name)
+        self.addfile(info)
+
+    def add_file(self, name, path, data=None):
+        data = self.content(path, data)
+        with open(path, "rb") as f:
+            info = self.tar.gettarinfo(arcname=name, fileobj=f)
+            if data is None:
+                self.addfile(info, f)
+                return
+        info.size = len(data)
+        self.addfile(info, io.BytesIO(data))
+
+    def finish(self):
+        self.tar.close()
+        if self.compressor is not None:
+            self.compressor.close()
+            self.cpu_time += getattr(self.compressor, "cpu_time", 0.0)
+        if self.process is not None:
+            self.process.stdin.close()
+            self.copier.join()
+            result = self.wait()
+            if result != 0:
+                raise subprocess.CalledProcessError(result, self.process.args)
+        self.file.close()
+        self.sha256 = self.file.hexdigest()
+
+    def wait(self):
+        """Wait for the compressor process, adding its CPU time."""
+        if not hasattr(os, "wait4"):
+            return self.process.wait()
+        pid, status, usage = os.wait4(self.process.pid, 0)
+        self.cpu_time += usage.ru_utime + usage.ru_stime
+        if os.WIFSIGNALED(status):
+            self.process.returncode = -os.WTERMSIG(status)
+        else:
+            self.process.returncode = os.WEXITSTATUS(status)
+        return self.process.returncode
+
+
+class ZipWriter(ArchiveWriter):
+    encoder = "deflate level 9"
+
+    def __init__(
+        self, filename, suffix=".zip", eol=None, threads=1, mtime=None, seekable=False
+    ):
+        # Zip files are always seekable
+        super(ZipWriter, self).__init__(filename, eol, threads, mtime)
+        # The same level as zip -9
+        self.zip = zipfile.ZipFile(
+            filename, "w", zipfile.ZIP_DEFLATED, allowZip64=True, compresslevel=9
+        )
+
+    def info(self, name, path):
+        # A reproducible entry, dated in UTC rather than local time
+        st = os.stat(path)
+        mode, mtime = self.normalize(st.st_mode, st.st_mtime)
+        info = zipfile.ZipInfo(name, time.gmtime(max(mtime, 315532800))[:6])
+        info.create_system = 3
+        info.external_attr = mode << 16
+        if stat.S_ISDIR(mode):
+            info.external_attr |= 0x10
+        return info
+
+    def add_dir(self, name, path=None):
+        if path is None:
+            if self.mtime is None:
+                info = zipfile.ZipInfo(name + "/", time.localtime()[:6])
+            else:
+                info = zipfile.ZipInfo(name + "/", time.gmtime(self.mtime)[:6])
+                info.create_system = 3
+            info.external_attr = (stat.S_IFDIR | 0o755) << 16 | 0x10
+            self.zip.writestr(info, b"")
+        elif self.mtime is not None:
+            self.zip.writestr(self.info(name + "/", path), b"")
+        else:
+            self.zip.write(path, name)
+        self.count()
+
+    def add_file(self, name, path, data=None):
+        data = self.content(path, data)
+        if self.mtime is not None:
+            if data is None:
+                with open(path, "rb") as f:
+                    data = f.read()
+            info = self.info(name, path)
+        elif data is None:
+            self.zip.write(path, name)
+            self.count(os.path.getsize(path))
+            return
+        else:
+            info = zipfile.ZipInfo.from_file(path, name)
+        self.zip.writestr(info, data, zipfile.ZIP_DEFLATED, 9)
+        self.count(len(data))
+
+    def finish(self):
+        self.zip.close()
+
+
+class SevenZipWriter(ArchiveWriter):
+    """
+    7z archives, when the py7zr module is installed. They are not made
+    reproducible.
+    """
+
+    encoder = "lzma2 preset 7, solid"
+
+    def __init__(
+        self, filename, suffix=".7z", eol=None, threads=1, mtime=None, seekable=False
+    ):
+        super(SevenZipWriter, self).__init__(filename, eol, threads, mtime)
+        if py7zr is None:
+            raise ValueError("Writing %s needs the py7zr module" % filename)
+        if seekable:
+            raise ValueError("%s can not be made seekable" % filename)
+        # The same level as 7z -mx=7; py7zr archives are solid
+        self.archive = py7zr.SevenZipFile(
+            filename, "w", filters=[{"id": py7zr.FILTER_LZMA2, "preset": 7}]
+        )
+
+    def add_dir(self, name, path=None):
+        # Folders without a source are implied by the files below them
+        if path is not None:
+            self.archive.write(path, name)
+            self.count()
+
+    def add_file(self, name, path, data=None):
+        data = self.content(path, data)
+        if data is None:
+            self.archive.write(path, name)
+            self.count(os.path.getsize(path))
+        else:
+            self.archive.writestr(data, name)
+            self.count(len(data))
+
+    def finish(self):
+        self.archive.close()
+
+
+writers = [
+    (".tar.gz", TarWriter),
+    (".tgz", TarWriter),
+    (".tar.bz2", TarWriter),
+    (".tar.zst", TarWriter),
+    (".tar", TarWriter),
+    (".zip", ZipWriter),
+    (".7z", SevenZipWriter),
+]
+
+
+def can_write(filename):
+    """
+    Whether archives like filename can be written here: .tar.zst files
+    need zstd or the zstandard module, and .7z files the py7zr module.
+    """
+    if filename.endswith(".tar.zst"):
+        return zstandard is not None or compress_program("zst", 1) is not None
+    if filename.endswith(".7z"):
+        return py7zr is not None
+    return any(filename.endswith(suffix) for suffix, klass in writers)
+
+
+def open_archive(filename, eol=None, threads=1, mtime=None, seekable=False):
+    """
+    A writer for filename, chosen by its suffix. With eol="crlf", text
+    files are written with CRLF line endings. .tar.gz and .tar.bz2 files
+    are compressed with threads threads. With an mtime, as a time stamp,
+    or else with $SOURCE_DATE_EPOCH set, the archive is reproducible.
+    seekable .tar.gz files are compressed in small blocks, so that their
+    archive_index can point at each file; .zip and .tar files always are.
+    """
+    if mtime is None and os.environ.get("SOURCE_DATE_EPOCH"):
+        mtime = int(os.environ["SOURCE_DATE_EPOCH"])
+    for suffix, klass in writers:
+        if filename.endswith(suffix):
+            return klass(filename, suffix, eol, threads, mtime, seekable)
+    raise ValueError('Do not know how to write archives like "%s"' % filename)
+
+
+class FanOut(object):
+    """
+    Writes the same entries to several writers at once. Each file is read
+    here, once, and its content queued to every writer, which runs in a
+    thread of its own, so writing takes as long as the slowest writer and
+    not the sum of them all. Behaves as an ArchiveWriter.
+    """
+
+    # Entries queued to a writer that fell behind, at most
+    queue_size = 256
+
+    def __init__(self, writers):
+        self.writers = writers
+        self.queues = [queue.Queue(self.queue_size) for w in writers]
+        self.errors = []
+        self.threads = [
+            threading.Thread(target=self.run, args=(w, q))
+            for w, q in zip(writers, self.queues)
+        ]
+        for t in self.threads:
+            t.start()
+
+    def run(self, writer, entries):
+        started = time.thread_time()
+        failed = False
+        while True:
+            entry = entries.get()
+            if entry is None:
+                break
+            if failed:
+                # Keep draining, so that the scan does not block
+                continue
+            try:
+                if entry[0] == "dir":
+                    writer.add_dir(entry[1], entry[2])
+                else:
+                    writer.add_file(entry[1], entry[2], entry[3])
+            except Exception as error:
+                self.errors.append(error)
+                failed = True
+        try:
+            writer.close()
+        except Exception as error:
+            self.errors.append(error)
+        writer.cpu_time += time.thread_time() - started
+
+    def put(self, entry, writers=None):
+        if self.errors:
+            raise self.errors[0]
+        for w, q in zip(self.writers, self.queues):
+            if writers is None or w in writers:
+                q.put(entry)
+
+    def add_dir(self, name, path=None, writers=None):
+        """As ArchiveWriter.add_dir, to writers only, if given."""
+        self.put(("dir", name, path), writers)
+
+    def add_file(self, name, path, data=None, writers=None):
+        """As ArchiveWriter.add_file, to writers only, if given."""
+        if data is None:
+            with open(path, "rb") as f:
+                data = f.read()
+        self.put(("file", name, path, data), writers)
+
+    def close(self):
+        for q in self.queues:
+            q.put(None)
+        for t in self.threads:
+            t.join()
+        if self.errors:
+            raise self.errors[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# The documentation folders, relative to the top of a release tree, that
+# the nodocs packages leave out
+doc_folders = ["libs/*/doc", "libs/numeric/*/doc", "tools/*/doc", "doc"]
+
+
+def is_doc_folder(name):
+    """Whether name, a "/" separated folder, matches one of doc_folders."""
+    parts = name.split("/")
+    for pattern in doc_folders:
+        pattern = pattern.split("/")
+        if len(pattern) == len(parts) and all(
+            fnmatch.fnmatchcase(p, q) for p, q in zip(parts, pattern)
+        ):
+            return True
+    return False
+
+
+def in_doc_folders(name):
+    """
+    Whether name, a "/" separated path in a release archive, below its top
+    folder, is one of doc_folders or in one of them.
+    """
+    parts = name.rstrip("/").split("/")[1:]
+    return any(is_doc_folder("/".join(parts[:i])) for i in range(1, len(parts) + 1))
+
+
+def copy_range(source, dest, length, block_size=1 << 20):
+    """Copy length bytes from the file object source to dest."""
+    while length:
+        block = source.read(min(length, block_size))
+        if not block:
+            raise EOFError("%s is truncated" % getattr(source, "name", "archive"))
+        dest.write(block)
+        length -= len(block)
+
+
+def filter_zip(source, dest, drop):
+    """
+    filter_archive for zip files, zip64 ones included: the local headers
+    and compressed data of the entries that are kept are copied as they
+    are, and only the central directory is rewritten, for their new
+    offsets.
+    """
+    with open(source, "rb") as f, open(dest, "wb") as out:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        start = max(0, size - 22 - 20 - 0xFFFF)
+        f.seek(start)
+        tail = f.read()
+        end = tail.rfind(b"PK\x05\x06")
+        if end < 0:
+            raise zipfile.BadZipFile("%s is not a zip file" % source)
+        fields = struct.unpack("<4s4H2LH", tail[end : end + 22])
+        directory_size, directory_offset, comment_length = fields[5:]
+        comment = tail[end + 22 : end + 22 + comment_length]
+        if end >= 20 and tail[end - 20 : end - 16] == b"PK\x06\x07":
+            # A zip64 end of central directory record, located by the
+            # locator before the end record, has the real figures
+            f.seek(struct.unpack("<4sLQL", tail[end - 20 : end])[2])
+            fields = struct.unpack("<4sQ2H2L4Q", f.read(56))
+            directory_size, directory_offset = fields[8:]
+        f.seek(directory_offset)
+        directory = f.read(directory_size)
+
+        # Where each entry is in source, (offset, offset of the next one)
+        records = []
+        position = 0
+        while position < len(directory):
+            fields = struct.unpack("<4s6H3L5H2L", directory[position : position + 46])
+            flags = fields[3]
+            name_length, extra_length, comment_length = fields[10:13]
+            record = directory[position : position + 46 + sum(fields[10:13])]
+            position += len(record)
+            # Where the offset is in record: in its zip64 extra field, if
+            # it did not fit in the 32 bits at 42
+            offset, at = fields[16], 42
+            if offset == 0xFFFFFFFF:
+                extra = 46 + name_length
+                while extra < 46 + name_length + extra_length:
+                    tag, length = struct.unpack("<HH", record[extra : extra + 4])
+                    if tag == 1:
+                        # The sizes come first, if they did not fit either
+                        at = extra + 4 + 8 * (fields[8:10].count(0xFFFFFFFF))
+                        offset = struct.unpack("<Q", record[at : at + 8])[0]
+                        break
+                    extra += 4 + length
+            name = record[46 : 46 + name_length]
+            name = name.decode("utf-8" if flags & 0x800 else "cp437")
+            records.append((offset, at, name, record))
+
+        # Each entry spans up to the next one, or the central directory:
+        # its local header, its data, and its data descriptor if it has one
+        offsets = sorted(set(r[0] for r in records)) + [directory_offset]
+        ends = dict(zip(offsets, offsets[1:]))
+        directory = []
+        dropped = 0
+        for offset, at, name, record in records:
+            if drop(name):
+                dropped += 1
+                continue
+            # The output offset is never past the source one, so it fits
+            # where that one was
+            packed = struct.pack("<Q" if at != 42 else "<L", out.tell())
+            directory.append(record[:at] + packed + record[at + len(packed) :])
+            f.seek(offset)
+            copy_range(f, out, ends[offset] - offset)
+
+        directory_offset = out.tell()
+        for record in directory:
+            out.write(record)
+        directory_size = out.tell() - directory_offset
+        count = len(directory)
+        if (
+            count > zipfile.ZIP_FILECOUNT_LIMIT
+            or directory_offset > zipfile.ZIP64_LIMIT
+            or directory_size > zipfile.ZIP64_LIMIT
+        ):
+            # As zipfile does, a zip64 end record and its locator first
+            end64 = out.tell()
+            out.write(
+                struct.pack(
+                    "<4sQ2H2L4Q",
+                    b"PK\x06\x06",
+                    44,
+                    45,
+                    45,
+                    0,
+                    0,
+                    count,
+                    count,
+                    directory_size,
+                    directory_offset,
+                )
+                + struct.pack("<4sLQL", b"PK\x06\x07", 0, end64, 1)
+            )
+        out.write(
+            struct.pack(
+                "<4s4H2LH",
+                b"PK\x05\x06",
+                0,
+                0,
+                min(count, 0xFFFF),
+                min(count, 0xFFFF),
+                min(directory_size, 0xFFFFFFFF),
+                min(directory_offset, 0xFFFFFFFF),
+                len(comment),
+            )
+            + comment
+        )
+    return dropped
+
+
+def filter_tar(source, dest, drop, threads=None):
+    """
+    filter_archive for tar files, read as a stream and written by a
+    TarWriter, which compresses them again. The compressed ones are read
+    to their end, through all the gzip members, bzip2 streams or zstd
+    frames that a ParallelCompressor, pigz, lbzip2 or pbzip2 writes.
+    """
+    process = None
+    f = open(source, "rb")
+    if source.endswith(".tar.zst"):
+        # tarfile does not read zstd
+        if zstandard is not None:
+            stream = zstandard.ZstdDecompressor().stream_reader(
+                f, read_across_frames=True, closefd=False
+            )
+        else:
+            process = subprocess.Popen(["zstd", "-dc", source], stdout=subprocess.PIPE)
+            stream = process.stdout
+    elif source.endswith((".tar.gz", ".tgz")):
+        # tarfile's own "r|gz" stops after the first member
+        stream = gzip.GzipFile(fileobj=f, mode="rb")
+    elif source.endswith(".tar.bz2"):
+        stream = bz2.BZ2File(f, "rb")
+    else:
+        stream = f
+    tar = tarfile.open(fileobj=stream, mode="r|")
+    dropped = 0
+    try:
+        with open_archive(dest, threads=threads or os.cpu_count() or 1) as writer:
+            for info in tar:
+                if drop(info.name):
+                    dropped += 1
+                elif info.isfile():
+                    writer.addfile(info, tar.extractfile(info))
+                else:
+                    writer.addfile(info)
+    finally:
+        tar.close()
+        stream.close()
+        f.close()
+    if process is not None and process.wait() != 0:
+        raise subprocess.CalledProcessError(process.returncode, process.args)
+    return dropped
+
+
+def filter_archive(source, dest, drop=in_doc_folders, threads=None):
+    """
+    Write to dest the archive source without the entries for whose names
+    drop is True, by default those in doc_folders, as for the nodocs
+    packages. source is read entry by entry and nothing is extracted to
+    disk. Zip entries are copied without being recompressed; tar files,
+    .tar.gz, .tar.bz2 or .tar.zst, are compressed again as open_archive
+    would, with threads threads. Returns the number of entries dropped.
+    """
+    if source.endswith(".zip"):
+        return filter_zip(source, dest, drop)
+    if any(source.endswith(suffix) for suffix in TarWriter.modes):
+        return filter_tar(source, dest, drop, threads)
+    raise ValueError('Do not know how to filter archives like "%s"' % source)
+
+
+def archive_tree(
+    root,
+    filenames,
+    eol=None,
+    threads=1,
+    exclude=(),
+    mtime=None,
+    nodocs=(),
+    seekable=(),
+):
+    """
+    Write the tree root, as a folder named after it, to all the archives
+    in filenames, reading it once. threads is the number of threads of
+    every archive, or a {filename: threads} dict, as allocate_threads
+    returns. exclude lists the names, relative to root and "/" separated,
+    that are left out. mtime makes the archives reproducible, as for
+    open_archive. The archives in filenames that are in nodocs leave the
+    doc_folders out, and those in seekable are written seekable.
+
+    Returns {filename: metrics} of the archives; see
+    ArchiveWriter.metrics. Their "sha256" is None unless the archive was
+    hashed while written.
+    """
+    top = os.path.basename(os.path.normpath(root))
+    if not isinstance(threads, dict):
+        threads = dict((f, threads) for f in filenames)
+    writers = [
+        open_archive(f, eol, threads[f], mtime, f in seekable) for f in filenames
+    ]
+    docs = [w for w in writers if w.filename not in nodocs]
+    # The folders inside doc_folders, with their content, only go to docs
+    in_docs = set()
+    with FanOut(writers) as out:
+        for dirpath, dirs, files in tree_walk.walk(root):
+            rel = os.path.relpath(dirpath, root)
+            if rel == ".":
+                rel = ""
+            else:
+                rel = "/".join(rel.split(os.sep))
+                if os.path.dirname(rel) in in_docs or is_doc_folder(rel):
+                    in_docs.add(rel)
+                rel += "/"
+            to = docs if rel.rstrip("/") in in_docs else None
+            if to == []:
+                # No archive wants anything below
+                del dirs[:]
+                continue
+            out.add_dir((top + "/" + rel).rstrip("/"), dirpath, to)
+            for entry in files:
+                if rel + entry.name not in exclude:
+                    out.add_file(top + "/" + rel + entry.name, entry.path, None, to)
+    return dict((w.filename, w.metrics()) for w in writers)
+
+
+# The size of the blocks of a seekable .tar.gz file. A file in it is read
+# by getting and decompressing the blocks it spans, so they are smaller
+# than those of a ParallelCompressor, at the cost of a percent or two.
+seekable_block_size = 1 << 20
+
+
+class GzipMembers(object):
+    """
+    A read only file object, decompressing the gzip file fileobj, that
+    notes where its members are: members lists the (offset, compressed
+    size, uncompressed offset) of each member read so far.
+    """
+
+    def __init__(self, fileobj, read_size=1 << 16):
+        self.fileobj = fileobj
+        self.read_size = read_size
+        self.members = []
+        self.decompressor = None
+        # What was read from fileobj, at offset, and not decompressed yet
+        self.input = b""
+        self.offset = 0
+        self.buffer = bytearray()
+        self.position = 0
+        self.eof = False
+
+    def fill(self):
+        if not self.input:
+            self.input = self.fileobj.read(self.read_size)
+            if not self.input:
+                if self.decompressor is not None:
+                    raise EOFError("Truncated gzip member at %d" % self.start[0])
+                self.eof = True
+                return
+        if self.decompressor is None:
+            self.decompressor = zlib.decompressobj(31)
+            self.start = (self.offset, self.position)
+        data = self.decompressor.decompress(self.input)
+        unused = self.decompressor.unused_data
+        self.offset += len(self.input) - len(unused)
+        self.input = unused
+        self.buffer += data
+        self.position += len(data)
+        if self.decompressor.eof:
+            self.members.append(
+                (self.start[0], self.offset - self.start[0], self.start[1])
+            )
+            self.decompressor = None
+
+    def read(self, size=-1):
+        while not self.eof and (size < 0 or len(self.buffer) < size):
+            self.fill()
+        if size < 0:
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+
+def archive_index(filename):
+    """
+    An index of the files in the archive filename, a .zip, .tar or
+    seekable .tar.gz file, from which a server can get one of them with
+    an HTTP range request instead of the whole archive. It is a dict with
+    the "file" name of the archive and a list of "entries", each with:
+
+    - "name", the name of the file in the archive;
+    - "offset" and "compressed_size", the range of the archive to get;
+    - "method", how that range is compressed: "store", raw "deflate" or
+      "gzip" members;
+    - "skip", for "gzip", what comes before the file in the decompressed
+      range;
+    - "size" and "crc32", of the file.
+    """
+    entries = []
+    if filename.endswith(".zip"):
+        methods = {zipfile.ZIP_STORED: "store", zipfile.ZIP_DEFLATED: "deflate"}
+        with open(filename, "rb") as f:
+            for info in zipfile.ZipFile(f).infolist():
+                if info.is_dir():
+                    continue
+                # The data follows the local header, whose extra field may
+                # differ from the one in the central directory
+                f.seek(info.header_offset + 26)
+                name_length, extra_length = struct.unpack("<HH", f.read(4))
+                entries.append(
+                    {
+                        "name": info.filename,
+                        "offset": info.header_offset + 30 + name_length + extra_length,
+                        "compressed_size": info.compress_size,
+                        "method": methods[info.compress_type],
+                        "size": info.file_size,
+                        "crc32": info.CRC,
+                    }
+                )
+    elif filename.endswith((".tar", ".tar.gz", ".tgz")):
+        with open(filename, "rb") as f:
+            stream = f
+            if not filename.endswith(".tar"):
+                stream = GzipMembers(f)
+            tar = tarfile.open(fileobj=stream, mode="r|")
+            for info in tar:
+                if not info.isfile():
+                    continue
+                crc = 0
+                data = tar.extractfile(info)
+                for block in iter(lambda: data.read(1 << 20), b""):
+                    crc = zlib.crc32(block, crc)
+                entries.append(
+                    {
+                        "name": info.name,
+                        "offset": info.offset_data,
+                        "compressed_size": info.size,
+                        "method": "store",
+                        "size": info.size,
+                        "crc32": crc & 0xFFFFFFFF,
+                    }
+                )
+            tar.close()
+            if stream is not f:
+                # Find the members each file spans
+                stream.read()
+                members = stream.members
+                starts = [m[2] for m in members]
+                for entry in entries:
+                    first = bisect.bisect_right(starts, entry["offset"]) - 1
+                    end = entry["offset"] + max(entry["size"], 1)
+                    last = bisect.bisect_left(starts, end) - 1
+                    entry["skip"] = entry["offset"] - members[first][2]
+                    entry["offset"] = members[first][0]
+                    entry["compressed_size"] = (
+                        members[last][0] + members[last][1] - members[first][0]
+                    )
+                    entry["method"] = "gzip"
+    else:
+        raise ValueError('Do not know how to index archives like "%s"' % filename)
+    return {"file": os.path.basename(filename), "entries": entries}
+
+
+class Profile(object):
+    """
+    What writing one format costs: cpu is the relative CPU time per byte,
+    memory the memory per thread, and max_threads how many threads the
+    encoder can use, if it is limited.
+    """
+
+    def __init__(self, cpu, memory, max_threads=None):
+        self.cpu = cpu
+        self.memory = memory
+        self.max_threads = max_threads
+
+
+MB = 1 << 20
+
+# Rough costs at the levels used for the release packages: gzip -9, bzip2
+# -9, zstd -19, zip -9 and 7z -mx=7, whose LZMA2 encoder takes about 200
+# MB for every two threads with its 16 MB dictionary. zipfile and py7zr
+# only use one thread.
+profiles = {
+    ".tar.gz": Profile(1, 16 * MB),
+    ".tgz": Profile(1, 16 * MB),
+    ".tar.bz2": Profile(4, 24 * MB),
+    ".tar.zst": Profile(3, 100 * MB),
+    ".tar": Profile(0.1, 1 * MB, 1),
+    ".zip": Profile(1, 4 * MB, 1),
+    ".7z": Profile(6, 100 * MB),
+}
+
+
+def read_cgroup(*paths):
+    """The first line of the first of paths that can be read, or None."""
+    for path in paths:
+        try:
+            with open(os.path.join("/sys/fs/cgroup", path)) as f:
+                return f.readline().strip()
+        except (IOError, OSError):
+            pass
+    return None
+
+
+def available_cpus():
+    """
+    The number of CPUs this process may use: those it is scheduled on,
+    within the cgroup CPU quota (cgroup v2 cpu.max, or v1 cfs_quota_us).
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = read_cgroup("cpu.max")
+    if quota:
+        quota, period = (quota.split() + ["100000"])[:2]
+    else:
+        quota = read_cgroup("cpu/cpu.cfs_quota_us", "cpu,cpuacct/cpu.cfs_quota_us")
+        period = read_cgroup("cpu/cpu.cfs_period_us", "cpu,cpuacct/cpu.cfs_period_us")
+    if quota and quota not in ("max", "-1") and period:
+        cpus = min(cpus, max(1, int(int(quota) // int(period))))
+    return cpus
+
+
+def available_memory():
+    """
+    The memory left to this process: what its cgroup (v2 memory.max, or
+    v1 memory.limit_in_bytes) has not used yet, or else the physical
+    memory.
+    """
+    memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    for limit, usage in [
+        ("memory.max", "memory.current"),
+        ("memory/memory.limit_in_bytes", "memory/memory.usage_in_bytes"),
+    ]:
+        value = read_cgroup(limit)
+        if value and value.isdigit() and int(value) < memory:
+            memory = int(value) - int(read_cgroup(usage) or 0)
+            break
+    return memory
+
+
+def allocate_threads(filenames, cpus=None, memory=None):
+    """
+    {filename: threads} for writing all of filenames at the same time:
+    the cpus CPUs are shared in proportion to the CPU cost of each format,
+    as far as it can use them and each thread's memory fits in memory.
+    Every archive gets at least one thread. cpus and memory default to
+    what the cgroup allows.
+    """
+    if cpus is None:
+        cpus = available_cpus()
+    if memory is None:
+        memory = available_memory()
+    costs = {}
+    for f in filenames:
+        for suffix, klass in writers:
+            if f.endswith(suffix):
+                costs[f] = profiles[suffix]
+                break
+        else:
+            raise ValueError('Do not know how to write archives like "%s"' % f)
+
+    threads = dict((f, 1) for f in filenames)
+    spare_cpus = cpus - len(filenames)
+    spare_memory = memory - sum(p.memory for p in costs.values())
+    # Hand out the other CPUs one at a time, to the archive with the most
+    # work per thread that can still take one.
+    while spare_cpus > 0:
+        candidates = [
+            f
+            for f, p in costs.items()
+            if (p.max_threads is None or threads[f] < p.max_threads)
+            and p.memory <= spare_memory
+        ]
+        if not candidates:
+            break
+        f = max(candidates, key=lambda f: (costs[f].cpu / threads[f], f))
+        threads[f] += 1
+        spare_cpus -= 1
+        spare_memory -= costs[f].memory
+    return threads
+
+
+class Utilization(object):
+    """
+    Measures how busy the CPUs were kept, from the CPU time used by this
+    process and its children while in the with block:
+
+        with Utilization(cpus) as u:
+            ...
+        print(u)
+    """
+
+    def __init__(self, cpus=None):
+        self.cpus = cpus or available_cpus()
+
+    def cpu_time(self):
+        t = os.times()
+        return t[0] + t[1] + t[2] + t[3]
+
+    def __enter__(self):
+        self.start = (time.time(), self.cpu_time())
+        return self
+
+    def __exit__(self, *exc):
+        self.wall = time.time() - self.start[0]
+        self.cpu = self.cpu_time() - self.start[1]
+
+    def ratio(self):
+        return self.cpu / max(self.wall * self.cpus, 1e-9)
+
+    def __str__(self):
+        return "%.1fs, %.1f CPU seconds, %.0f%% of %d CPUs" % (
+            self.wall,
+            self.cpu,
+            100 * self.ratio(),
+            self.cpus,
+        )
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+#
+# Distributed under the Boost Software License, Version 1.0.
+# (See accompanying file LICENSE_1_0.txt or copy at
+# http://www.boost.org/LICENSE_1_0.txt)
+#
+# Tree walking shared by the copiers in MakeBoostDistro.py, mergeTree.py
+# and snapshot.py.
+#
+# The walk is built on os.scandir, so the type of each entry comes from
+# the directory listing itself instead of one os.path.isdir/exists/islink
+# stat call per name. Ignore globs are compiled once into a single regular
+# expression, instead of running every fnmatch pattern on every name.
+
+from __future__ import print_function
+
+import os
+import re
+import shutil
+import fnmatch
+
+
+class IgnorePatterns(object):
+    """
+    Compiled equivalent of shutil.ignore_patterns(*patterns). Instances
+    can be passed anywhere shutil expects an ignore callable.
+    """
+
+    def __init__(self, *patterns):
+        self.patterns = patterns
+        if patterns:
+            self.match = re.compile(
+                "|".join(fnmatch.translate(p) for p in patterns)
+            ).match
+        else:
+            self.match = lambda name: None
+
+    def ignored(self, name):
+        return self.match(os.path.normcase(name)) is not None
+
+    def __call__(self, path, names):
+        return set(name for name in names if self.ignored(name))
+
+
+def scan(path, ignore=None):
+    """
+    The entries of path as os.DirEntry objects, sorted by name, without the
+    names ignore rejects. ignore is an IgnorePatterns, any shutil style
+    ignore callable, or None.
+    """
+    with os.scandir(path) as it:
+        entries = sorted(it, key=lambda e: e.name)
+    if ignore is None:
+        return entries
+    if isinstance(ignore, IgnorePatterns):
+        return [e for e in entries if not ignore.ignored(e.name)]
+    ignored = ignore(path, [e.name for e in entries])
+    return [e for e in entries if e.name not in ignored]
+
+
+def walk(top, ignore=None, symlinks=False):
+    """
+    Like os.walk, but yields (dirpath, dirs, files) lists of DirEntry
+    objects and skips ignored names. With symlinks=False, links to
+    folders are followed, as shutil.copytree does; otherwise they are
+    reported with the files.
+    """
+    dirs = []
+    files = []
+    for entry in scan(top, ignore):
+        if entry.is_dir(follow_symlinks=not symlinks):
+            dirs.append(entry)
+        else:
+            files.append(entry)
+    yield top, dirs, files
+    for entry in dirs:
+        for result in walk(entry.path, ignore, symlinks):
+            yield result
+
+
+def mergetree(src, dst, symlinks=False, ignore=None, copy_function=shutil.copy2):
+    """
+    shutil.copytree into a dst that may already exist. Files already in
+    dst are overwritten. Errors are collected and raised together as
+    shutil.Error once everything else has been copied.
+    """
+    if not os.path.isdir(dst):
+        os.makedirs(dst)
+
+    errors = []
+    for entry in scan(src, ignore):
+        srcname = entry.path
+        dstname = os.path.join(dst, entry.name)
+        try:
+            if symlinks and entry.is_symlink():
+                linkto = os.readlink(srcname)
+                os.symlink(linkto, dstname)
+            elif entry.is_dir():
+                mergetree(srcname, dstname, symlinks, ignore, copy_function)
+            else:
+                copy_function(srcname, dstname)
+            # XXX What about devices, sockets etc.?
+        except shutil.Error as err:
+            # catch the Error from the recursive mergetree so that we can
+            # continue with other files
+            errors.extend(err.args[0])
+        except (IOError, os.error) as why:
+            errors.append((srcname, dstname, str(why)))
+    try:
+        shutil.copystat(src, dst)
+    except OSError as why:
+        # can't copy file access times on Windows
+        if os.name != "nt":
+            errors.append((src, dst, str(why)))
+    if errors:
+        raise shutil.Error(errors)